@@ -1,28 +1,19 @@
 import re
-import requests
-from bs4 import BeautifulSoup
-from google.cloud import firestore
 
-# Initialize Firestore
-db = firestore.Client.from_service_account_json("serviceAccountKey.json")
+from firestore_writer import BufferedWriter, get_db
+from http_client import fetch
+from parsers import parse_school_list
 
 def slugify_name(name: str) -> str:
     # Convert "University of Michigan" -> "university_of_michigan"
     return re.sub(r'[^a-z0-9]+', '_', name.strip().lower()).strip('_')
 
 def fetch_schools(url: str):
-    response = requests.get(url)
+    response = fetch(url)
     response.raise_for_status()
 
-    soup = BeautifulSoup(response.text, "html.parser")
-
-    # Select all <a> tags with the style attribute containing font-weight:600; 
-    # This matches the pattern from the provided snippet.
-    school_links = soup.select('div.inner-container.clearfix.discussions-section div[style*="padding:10px"] a[style*="font-weight:600;"]')
-
     schools = []
-    for link in school_links:
-        school_name = link.get_text(strip=True)
+    for school_name, _ in parse_school_list(response.text):
         # slugify main school name for discussion page URL (omit abbreviations after '-')
         main_name = school_name.split('-')[0].strip()
         slug = slugify_name(main_name)
@@ -34,18 +25,25 @@ def fetch_schools(url: str):
         })
     return schools
 
-def add_schools_to_firestore(schools):
-    for school in schools:
-        doc_id = slugify_name(school["name"].split('-')[0].strip())
-        doc_ref = db.collection("schools").document(doc_id)
-        doc_ref.set({
-            "name": school["name"],
-            "discussionPageUrl": school["discussionPageUrl"]
-        })
-        print(f"Added/Updated school: {school['name']}")
+def add_schools_to_firestore(schools, client=None):
+    # Returns the (document path, error) pairs that could not be written
+    client = client or get_db()
+    with BufferedWriter(client) as writer:
+        for school in schools:
+            doc_id = slugify_name(school["name"].split('-')[0].strip())
+            doc_ref = client.collection("schools").document(doc_id)
+            writer.set(doc_ref, {
+                "name": school["name"],
+                "discussionPageUrl": school["discussionPageUrl"]
+            })
+    print(f"Added/Updated {writer.written} schools.")
+    for path, error in writer.failures:
+        print(f"Failed to write {path}: {error}")
+    return writer.failures
 
 if __name__ == "__main__":
-    url = "https://www.greekrank.com/list/"
-    schools_list = fetch_schools(url)
-    add_schools_to_firestore(schools_list)
-    print("All schools have been added/updated successfully.")
\ No newline at end of file
+    # Same as `python cli.py schools ...`, which also stores uni_id and the search fields
+    import sys
+    from cli import main
+
+    main(["schools", *sys.argv[1:]])
@@ -0,0 +1,491 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_fixtures")
+DEFAULT_BASELINE = "bench_baseline.json"
+SCENARIOS = ("fetch_schools", "scrape_greekrank_posts", "scrape_post_details", "shard_retry", "startup",
+             "comment_memory")
+
+# Which way is "better" for each reported metric; the rest are informational
+HIGHER_IS_BETTER = ("pages_per_sec", "posts_per_sec")
+LOWER_IS_BETTER = ("fetch_p50_ms", "fetch_p99_ms", "parse_p50_ms", "parse_p99_ms", "peak_rss_mb", "startup_ms",
+                   "comment_peak_mb", "comment_pipeline_peak_mb")
+
+# ---------------------- Fixtures ----------------------
+def load_fixtures(directory=FIXTURES_DIR):
+    """Fixture pages keyed by kind, with <time datetime> values shifted so the newest posts are fresh.
+
+    The crawl only follows posts from the last two weeks, so recorded dates
+    are moved forward by however long ago the fixtures were recorded.
+    """
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    recorded_at = datetime.strptime(manifest["recorded_at"], "%Y-%m-%d %H:%M:%S")
+    shift = datetime.now(timezone.utc).replace(tzinfo=None) - recorded_at
+
+    def rebase(match):
+        moved = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S") + shift
+        return f'datetime="{moved.strftime("%Y-%m-%d %H:%M:%S")}"'
+
+    def read(name):
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            html = f.read()
+        return re.sub(r'datetime="(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)"', rebase, html).encode("utf-8")
+
+    return {
+        "list": read("list.html"),
+        "listing": [read(f"listing_{n}.html") for n in range(1, manifest["listing_pages"] + 1)],
+        "thread": [read(f"thread_{n}.html") for n in range(1, manifest["thread_pages"] + 1)],
+    }
+
+def record_fixtures(uni_id, thread_url, directory=FIXTURES_DIR):
+    """Refresh the fixtures from the live site: /list/, a school's listing pages and one multi-page thread."""
+    from http_client import fetch
+    from parsers import BASE_URL, listing_page_url, parse_listing_page, parse_thread_page, thread_page_url
+
+    def save(name, url):
+        response = fetch(url)
+        response.raise_for_status()
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(response.text)
+        print(f"Recorded {url} -> {name}")
+        return response.text
+
+    save("list.html", f"{BASE_URL}/list/")
+    listing_pages = 0
+    while True:
+        listing_pages += 1
+        parsed = parse_listing_page(save(f"listing_{listing_pages}.html", listing_page_url(uni_id, listing_pages)))
+        if parsed is None or not parsed[1] or listing_pages == 2:
+            break
+    thread_pages = 0
+    while True:
+        thread_pages += 1
+        _, _, has_next, _ = parse_thread_page(save(f"thread_{thread_pages}.html",
+                                                   thread_page_url(thread_url, thread_pages)))
+        if not has_next:
+            break
+
+    manifest = {
+        "recorded_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "listing_pages": listing_pages,
+        "thread_pages": thread_pages,
+    }
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+# ---------------------- Stub Server ----------------------
+LISTING_PATH = re.compile(r"^/uni/(\d+)/discussion/(?:page-(\d+)/)?$")
+THREAD_PATH = re.compile(r"^/uni/\d+/discussion/\d+/[^/]+/(?:page-(\d+)/)?$")
+
+class StubServer:
+    """Local stand-in for greekrank.com serving the fixtures.
+
+    Every school gets the same listing pages (with thread links renumbered
+    per school) and every thread the same pages. Each request sleeps `latency` seconds (plus up to `jitter`) and
+    fails with `error_status` at `error_rate`, to exercise the retry path.
+    """
+
+    def __init__(self, fixtures, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=0, port=0):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def page(self, path):
+        if path == "/list/":
+            return self.fixtures["list"]
+        match = LISTING_PATH.match(path)
+        if match:
+            number = int(match.group(2) or 1)
+            if number > len(self.fixtures["listing"]):
+                return None
+            # Give each school its own thread IDs, as on the real site
+            uni_id = int(match.group(1))
+            return re.sub(rb"/uni/\d+/discussion/(\d+)/",
+                          lambda m: b"/uni/%d/discussion/%d/" % (uni_id, uni_id * 1000000 + int(m.group(1))),
+                          self.fixtures["listing"][number - 1])
+        match = THREAD_PATH.match(path)
+        if not match:
+            return None
+        number = int(match.group(1) or 1)
+        pages = self.fixtures["thread"]
+        return pages[number - 1] if number <= len(pages) else None
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # otherwise delayed ACKs add ~40ms to keep-alive requests
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                    delay = stub.latency + stub._random.uniform(0, stub.jitter)
+                    failed = stub._random.random() < stub.error_rate
+                    stub.errors += failed
+                if delay:
+                    time.sleep(delay)
+                body = None if failed else stub.page(self.path)
+                status = stub.error_status if failed else (200 if body is not None else 404)
+                body = body or b""
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="bench-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+# ---------------------- Scenarios ----------------------
+class ParseTimer:
+    """Wraps a parse function and records how long each call took."""
+
+    def __init__(self, parse):
+        self.parse = parse
+        self.latencies = []
+
+    def __call__(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self.parse(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else None
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux but bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_scenario(name, base_url, options):
+    """Run one scenario against the stub; called in a fresh process so peak RSS is its own."""
+    import fake_firestore
+    import firestore_writer
+    import http_client
+    import parsers
+    import scrape
+
+    parsers.BASE_URL = base_url
+    if options.get("parser"):
+        parsers.set_backend(options["parser"])
+    client = http_client.configure(limiter=None, pool_size=16, backoff_base=0.05, backoff_max=1.0)
+    db = fake_firestore.Client()
+    firestore_writer.use_client(db)
+    timers = {}
+    for parse in ("parse_school_list", "parse_listing_page", "parse_thread_page"):
+        timers[parse] = ParseTimer(getattr(scrape, parse))
+        setattr(scrape, parse, timers[parse])
+
+    posts = 0
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if name == "fetch_schools":
+            for _ in range(options["iterations"]):
+                scrape.fetch_schools(f"{base_url}/list/")
+        elif name == "scrape_greekrank_posts":
+            for uni_id in range(1, options["schools"] + 1):
+                scrape.scrape_greekrank_posts(str(uni_id), db.collection("schools").document(f"school_{uni_id}"))
+            writer = firestore_writer.get_writer()
+            writer.flush()
+            posts = writer.written
+        elif name == "scrape_post_details":
+            for n in range(options["threads"]):
+                scrape.scrape_post_details(f"{base_url}/uni/62/discussion/{n}/thread-{n}/")
+                posts += 1
+        elif name == "shard_retry":
+            posts = run_shard_retry(db, options["schools"])
+        else:
+            raise ValueError(f"Unknown scenario {name!r}")
+    elapsed = time.perf_counter() - started
+    firestore_writer.get_writer().close()
+
+    fetches = client.stats.summary()
+    parse_latencies = [latency for timer in timers.values() for latency in timer.latencies]
+
+    def ms(seconds):
+        return round(seconds * 1000, 3) if seconds is not None else None
+
+    return {
+        "seconds": round(elapsed, 3),
+        "pages": fetches["requests"],
+        "posts": posts,
+        "pages_per_sec": round(fetches["requests"] / elapsed, 2),
+        "posts_per_sec": round(posts / elapsed, 2) if posts else None,
+        "fetch_p50_ms": ms(fetches.get("p50")),
+        "fetch_p99_ms": ms(fetches.get("p99")),
+        "parse_p50_ms": ms(percentile(parse_latencies, 0.50)),
+        "parse_p99_ms": ms(percentile(parse_latencies, 0.99)),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "retries": fetches["retries"],
+        "failures": fetches["failures"],
+    }
+
+def run_shard_retry(db, schools, fail_at=3):
+    """Shard-crawl `schools` with the `fail_at`-th thread of each failing on its first try; returns the posts written.
+
+    Each school is crawled again afterwards with nothing failing, and a
+    retried school that ended up with fewer posts than that is an error:
+    the thread that failed must be redone by the retry, not skipped.
+    """
+    import firestore_writer
+    import scrape
+    from dedup import SeenThreads
+    from http_client import FetchError
+    from sharding import LeaseStore, run_shard_worker
+
+    scrape_thread = scrape.scrape_thread
+    attempt = {"threads": 0, "first": False}
+    failed = set()
+
+    def flaky_scrape_thread(post_url):
+        attempt["threads"] += 1
+        if attempt["first"] and attempt["threads"] == fail_at:
+            raise FetchError(f"injected failure for {post_url}")
+        return scrape_thread(post_url)
+
+    def crawl_school(school):
+        attempt["threads"], attempt["first"] = 0, school["uni_id"] not in failed
+        failed.add(school["uni_id"])
+        scrape.scrape_greekrank_posts(school["uni_id"], retried[school["uni_id"]])
+
+    def posts_under(doc_ref):
+        prefix = f"{doc_ref.path}/posts/"
+        return sum(1 for path in db.documents if path.startswith(prefix) and "/" not in path[len(prefix):])
+
+    def flush():
+        writer = firestore_writer.get_writer()
+        failures = len(writer.failures)
+        writer.flush()
+        return len(writer.failures) == failures
+
+    retried = {str(n): db.collection("schools").document(f"retried_{n}") for n in range(1, schools + 1)}
+    with tempfile.TemporaryDirectory() as directory:
+        scrape.scrape_thread = flaky_scrape_thread
+        try:
+            run_shard_worker(LeaseStore(os.path.join(directory, "shards.db")),
+                             [{"uni_id": uni_id, "name": f"school {uni_id}"} for uni_id in retried], crawl_school,
+                             shards=4, poll_interval=0.05, flush=flush)
+        finally:
+            scrape.scrape_thread = scrape_thread
+
+    scrape.seen_threads = SeenThreads()
+    for uni_id, doc_ref in retried.items():
+        clean = db.collection("schools").document(f"clean_{uni_id}")
+        scrape.scrape_greekrank_posts(uni_id, clean)
+        firestore_writer.get_writer().flush()
+        if posts_under(doc_ref) != posts_under(clean):
+            raise RuntimeError(f"school {uni_id} was retried but wrote {posts_under(doc_ref)} of "
+                               f"{posts_under(clean)} posts")
+    return sum(posts_under(doc_ref) for doc_ref in retried.values())
+
+def run_startup(base_url, runs=5):
+    """Best-of-`runs` import-to-first-request time of a fresh `cli.py thread --dry-run` process."""
+    cli = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+    command = [sys.executable, cli, "thread", f"{base_url}/uni/62/discussion/1/thread-1/", "--dry-run",
+               "--no-listing", "--base-url", base_url]
+    timings = []
+    started = time.perf_counter()
+    for _ in range(runs):
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        timings.append(float(re.search(r"Startup: ([\d.]+) ms", output).group(1)))
+    return {"seconds": round(time.perf_counter() - started, 3), "startup_ms": min(timings),
+            "startup_max_ms": max(timings)}
+
+def run_comment_memory(count):
+    """Peak traced memory of `count` parsed comments as records.Comment vs the dicts parsers used to build.
+
+    The fixture thread is parsed once and its comments cloned with fresh
+    string copies, the way every parse of a new page produces them. The
+    pipeline figure holds comments parsed by pipeline.parse_page in a
+    process pool instead, so they arrive pickled the way ParsePipeline and
+    the parse cache hand them over. All figures are scaled to 100k comments.
+    """
+    from datetime import datetime, timezone
+    from parsers import parse_thread_page
+    from pipeline import parse_page
+    from records import Comment
+
+    pages = load_fixtures()["thread"]
+    parsed = [c for html in pages for c in parse_thread_page(html.decode("utf-8"))[1]]
+    sources = [(c.author, c.timestamp, c.content) for c in parsed]
+
+    def fresh(text):
+        return text.encode().decode()
+
+    def peak_mb(build):
+        tracemalloc.start()
+        held = [build(*sources[n % len(sources)]) for n in range(count)]
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del held
+        return peak / (1024 * 1024) * 100000 / count
+
+    def pipeline_peak_mb(batch=64):
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            tracemalloc.start()
+            held = []
+            while len(held) < count:
+                futures = [pool.submit(parse_page, "thread", pages[n % len(pages)], "utf-8") for n in range(batch)]
+                for future in futures:
+                    held.extend(future.result()[1])
+            del held[count:]
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        del held
+        return peak / (1024 * 1024) * 100000 / count
+
+    records_mb = peak_mb(lambda author, timestamp, content: Comment(fresh(author), timestamp, fresh(content)))
+    dicts_mb = peak_mb(lambda author, timestamp, content: {
+        "author": fresh(author), "date": datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else None,
+        "content": fresh(content)})
+    pipeline_mb = pipeline_peak_mb()
+    return {"comments": count, "comment_peak_mb": round(records_mb, 2), "comment_dict_peak_mb": round(dicts_mb, 2),
+            "comment_pipeline_peak_mb": round(pipeline_mb, 2), "memory_saved": f"{1 - records_mb / dicts_mb:.0%}",
+            "memory_saved_pipeline": f"{1 - pipeline_mb / dicts_mb:.0%}"}
+
+def run_benchmarks(scenarios, options, stub_options):
+    stub = StubServer(load_fixtures(), **stub_options).start()
+    results = {}
+    try:
+        for name in scenarios:
+            if name == "startup":
+                results[name] = run_startup(stub.base_url)
+                print(f"{name}: {results[name]}")
+                continue
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                if name == "comment_memory":
+                    results[name] = pool.submit(run_comment_memory, options["comments"]).result()
+                else:
+                    results[name] = pool.submit(run_scenario, name, stub.base_url, options).result()
+            print(f"{name}: {results[name]}")
+    finally:
+        stub.stop()
+    return results
+
+# ---------------------- Baseline ----------------------
+def compare(results, baseline, threshold=0.2):
+    """(scenario, metric, baseline, current) for every metric more than `threshold` worse than the baseline."""
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get("results", {}).get(name, {})
+        for metric, value in metrics.items():
+            old = base.get(metric)
+            if value is None or not old:
+                continue
+            if metric in HIGHER_IS_BETTER and value < old * (1 - threshold):
+                regressions.append((name, metric, old, value))
+            elif metric in LOWER_IS_BETTER and value > old * (1 + threshold):
+                regressions.append((name, metric, old, value))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scraper offline against recorded GreekRank pages.")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="run only these (repeatable)")
+    parser.add_argument("--iterations", type=int, default=20, help="fetch_schools runs")
+    parser.add_argument("--schools", type=int, default=5, help="schools for scrape_greekrank_posts and shard_retry")
+    parser.add_argument("--threads", type=int, default=50, help="threads for scrape_post_details")
+    parser.add_argument("--comments", type=int, default=100000, help="comments held for comment_memory")
+    parser.add_argument("--parser", choices=("lxml", "bs4"), help="parser backend (default: the usual choice)")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds the stub waits per request")
+    parser.add_argument("--jitter", type=float, default=0.005, help="extra random delay per request, up to this")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503, help="status used for injected errors")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run's results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown flagged as a regression")
+    parser.add_argument("--json", help="also write the results here")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="just run the stub server on this port (e.g. for sharding.py --base-url)")
+    parser.add_argument("--record", nargs=2, metavar=("UNI_ID", "THREAD_URL"),
+                        help="re-record the fixtures from the live site and exit")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixtures(*args.record)
+        raise SystemExit(0)
+
+    if args.serve is not None:
+        stub = StubServer(load_fixtures(), latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          error_status=args.error_status, port=args.serve).start()
+        print(f"Serving fixtures on {stub.base_url}; Ctrl-C to stop.")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            stub.stop()
+        raise SystemExit(0)
+
+    options = {"iterations": args.iterations, "schools": args.schools, "threads": args.threads, "parser": args.parser,
+               "comments": args.comments}
+    stub_options = {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate,
+                    "error_status": args.error_status}
+    results = run_benchmarks(args.scenario or SCENARIOS, options, stub_options)
+    report = {"created_at": datetime.now(timezone.utc).isoformat(), "options": {**options, **stub_options},
+              "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("options") != report["options"]:
+            print("Warning: baseline was recorded with different options; comparisons may not be meaningful.")
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, old, new in regressions:
+            print(f"REGRESSION {name}.{metric}: {old} -> {new}")
+        if regressions:
+            raise SystemExit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}.")
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one.")
@@ -0,0 +1,277 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from firestore_writer import get_writer
+from http_client import fetch
+from scrape import add_school_to_firestore, parse_schools, school_doc_id
+from search_index import normalize
+
+DEFAULT_PATH = "school_catalog.db"
+
+# Kinds of catalog change between two versions of /list/
+ADDED = "added"
+RENAMED = "renamed"
+REMOVED = "removed"
+
+Change = namedtuple("Change", "kind uni_id old_name new_name")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    list_hash TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    schools INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS schools (
+    uni_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    discussion_url TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    added_in INTEGER NOT NULL,
+    changed_in INTEGER NOT NULL,
+    removed_in INTEGER,
+    synced_name TEXT,
+    synced_doc_id TEXT,
+    synced_delisted INTEGER NOT NULL DEFAULT 0,
+    resync INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS schools_doc_id ON schools (doc_id);
+CREATE INDEX IF NOT EXISTS schools_name_key ON schools (name_key);
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER NOT NULL,
+    uni_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    old_name TEXT,
+    new_name TEXT
+);
+CREATE INDEX IF NOT EXISTS changes_version ON changes (version);
+"""
+
+COLUMNS = "uni_id, name, discussion_url, doc_id"
+
+def _school(row):
+    # fetch_schools() shape, plus the Firestore document ID
+    uni_id, name, discussion_url, doc_id = row
+    return {"name": name, "discussionPageUrl": discussion_url, "uni_id": uni_id, "doc_id": doc_id}
+
+def _prefix_bound(prefix):
+    # Smallest string greater than every string starting with `prefix`, so the range scan uses the index
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+# ---------------------- School Catalog ----------------------
+class Catalog:
+    """Versioned local snapshot of the /list/ school catalog in SQLite.
+
+    refresh() only parses /list/ when its hash differs from the latest
+    version's, and then records which schools were added, renamed or
+    removed. Lookups by uni_id, document ID (slug) or name prefix are index
+    scans, so nothing needs /list/ or Firestore to find a school. The
+    catalog also remembers what each school's Firestore document was last
+    written as: sync() queues writes only for schools that differ from
+    that, and save_synced() records them once the writer has flushed.
+
+    With in_memory=True the catalog works on a copy of `path` (or an empty
+    one) and nothing is ever written to disk, which is what --dry-run wants.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, in_memory=False):
+        self.path = path
+        self._local = threading.local()
+        self._memory = self._copy_to_memory(path) if in_memory else None
+        self._pending = {}  # uni_id -> (document paths, synced state once they land)
+        self._connection().executescript(SCHEMA)
+
+    @staticmethod
+    def _copy_to_memory(path):
+        # One connection shared by every thread: each ":memory:" connection is its own database
+        conn = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
+        if os.path.exists(path):
+            source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            source.backup(conn)
+            source.close()
+        return conn
+
+    def _connection(self):
+        if self._memory is not None:
+            return self._memory
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA mmap_size=67108864")  # lookups read straight from the page cache
+            self._local.conn = conn
+        return conn
+
+    def _conn(self):
+        return _Transaction(self._connection())
+
+    # ---- versions ----
+    def version(self):
+        """The latest version as a dict (version, list_hash, created_at, schools), or None before the first."""
+        row = self._connection().execute(
+            "SELECT version, list_hash, created_at, schools FROM versions ORDER BY version DESC LIMIT 1").fetchone()
+        return dict(zip(("version", "list_hash", "created_at", "schools"), row)) if row else None
+
+    def refresh(self, url):
+        """Fetch /list/ and record a new version if it changed; returns that version's changes."""
+        response = fetch(url)
+        response.raise_for_status()
+        list_hash = hashlib.sha256(response.content).hexdigest()
+        latest = self.version()
+        if latest and latest["list_hash"] == list_hash:
+            return []
+        return self.update(parse_schools(response.text), list_hash)
+
+    def update(self, schools, list_hash=""):
+        """Record `schools` (fetch_schools() dicts, in list order) as a new version; returns its changes."""
+        listed = {}
+        for school in schools:
+            listed.setdefault(school["uni_id"], school)
+        if not listed:
+            raise ValueError("No schools in the new catalog; keeping the current version")
+
+        with self._conn() as conn:
+            version = conn.execute("INSERT INTO versions (list_hash, created_at, schools) VALUES (?, ?, ?)",
+                                   (list_hash, time.time(), len(listed))).lastrowid
+            known = {uni_id: (name, removed_in) for uni_id, name, removed_in in
+                     conn.execute("SELECT uni_id, name, removed_in FROM schools")}
+            changes = []
+            for position, (uni_id, school) in enumerate(listed.items()):
+                name = school["name"]
+                row = (name, school_doc_id(school), normalize(name), school["discussionPageUrl"], position)
+                if uni_id not in known:
+                    changes.append(Change(ADDED, uni_id, None, name))
+                    conn.execute("INSERT INTO schools (name, doc_id, name_key, discussion_url, position, added_in, "
+                                 "changed_in, uni_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (*row, version, version, uni_id))
+                elif known[uni_id][1] is not None or known[uni_id][0] != name:
+                    old_name, removed_in = known[uni_id]
+                    changes.append(Change(ADDED if removed_in is not None else RENAMED, uni_id, old_name, name))
+                    conn.execute("UPDATE schools SET name = ?, doc_id = ?, name_key = ?, discussion_url = ?, "
+                                 "position = ?, changed_in = ?, removed_in = NULL WHERE uni_id = ?",
+                                 (*row, version, uni_id))
+                else:
+                    conn.execute("UPDATE schools SET position = ? WHERE uni_id = ?", (position, uni_id))
+            for uni_id, (name, removed_in) in known.items():
+                if removed_in is None and uni_id not in listed:
+                    changes.append(Change(REMOVED, uni_id, name, None))
+                    conn.execute("UPDATE schools SET removed_in = ?, changed_in = ? WHERE uni_id = ?",
+                                 (version, version, uni_id))
+            conn.executemany("INSERT INTO changes (version, uni_id, kind, old_name, new_name) VALUES (?, ?, ?, ?, ?)",
+                             [(version, change.uni_id, change.kind, change.old_name, change.new_name)
+                              for change in changes])
+        return changes
+
+    def changes(self, version):
+        return [Change(kind, uni_id, old_name, new_name) for uni_id, kind, old_name, new_name in
+                self._connection().execute("SELECT uni_id, kind, old_name, new_name FROM changes WHERE version = ?",
+                                           (version,))]
+
+    # ---- lookups ----
+    def schools(self):
+        """Every school on /list/ as of the latest version, in list order."""
+        return [_school(row) for row in self._connection().execute(
+            f"SELECT {COLUMNS} FROM schools WHERE removed_in IS NULL ORDER BY position")]
+
+    def school(self, uni_id):
+        """The listed school with this uni_id, or None."""
+        row = self._connection().execute(
+            f"SELECT {COLUMNS} FROM schools WHERE uni_id = ? AND removed_in IS NULL", (str(uni_id),)).fetchone()
+        return _school(row) if row else None
+
+    def __contains__(self, uni_id):
+        return self.school(uni_id) is not None
+
+    def by_slug(self, slug):
+        """Listed schools whose Firestore document is schools/{slug}; abbreviations make a few share one."""
+        return [_school(row) for row in self._connection().execute(
+            f"SELECT {COLUMNS} FROM schools WHERE doc_id = ? AND removed_in IS NULL ORDER BY position", (slug,))]
+
+    def search(self, prefix, limit=20):
+        """Listed schools whose name starts with `prefix`, compared the way search_index normalizes names."""
+        key = normalize(prefix)
+        if not key:
+            return []
+        return [_school(row) for row in self._connection().execute(
+            f"SELECT {COLUMNS} FROM schools WHERE name_key >= ? AND name_key < ? AND removed_in IS NULL "
+            "ORDER BY name_key LIMIT ?", (key, _prefix_bound(key), limit))]
+
+    # ---- Firestore sync ----
+    def sync(self, writer=None, index_hashes=None):
+        """Queue Firestore writes for schools whose document differs from the last synced catalog.
+
+        New and renamed schools get their document written; removed ones,
+        and the old document of a school whose rename moved it to another
+        slug, are marked `delisted` (their posts stay). Returns how many
+        schools were queued. With `index_hashes`, unchanged schools whose
+        search fields were built by an older search_index are rewritten too.
+        Schools flagged by resync() are written in full: their fingerprints
+        and search-index hashes are forgotten first, so neither store can
+        skip the write.
+        """
+        writer = writer or get_writer()
+        collection = writer.client.collection("schools")
+        conn = self._connection()
+        listed_doc_ids = {doc_id for doc_id, in conn.execute("SELECT doc_id FROM schools WHERE removed_in IS NULL")}
+        rows = conn.execute(
+            f"SELECT {COLUMNS}, removed_in, synced_doc_id, synced_delisted, resync, "
+            "resync OR synced_name IS NULL OR synced_name != name OR synced_doc_id != doc_id OR synced_delisted "
+            "FROM schools WHERE removed_in IS NULL OR (synced_doc_id IS NOT NULL AND NOT synced_delisted)")
+        for *columns, removed_in, synced_doc_id, synced_delisted, resync, changed in rows.fetchall():
+            school = _school(columns)
+            paths = []
+            if removed_in is None:
+                if not changed and (index_hashes is None or not index_hashes.changed(school["doc_id"], school["name"])):
+                    continue
+                if resync:
+                    if writer.fingerprints is not None:
+                        writer.fingerprints.forget(collection.document(school["doc_id"]).path)
+                    if index_hashes is not None:
+                        index_hashes.forget(school["doc_id"])
+                add_school_to_firestore(school, writer, index_hashes)
+                paths.append(collection.document(school["doc_id"]).path)
+                if synced_delisted:
+                    writer.set(collection.document(school["doc_id"]), {"delisted": False}, merge=True)
+                stale = synced_doc_id if synced_doc_id != school["doc_id"] else None
+                state = (school["name"], school["doc_id"], 0)
+            else:
+                stale = synced_doc_id
+                state = (None, synced_doc_id, 1)
+            if stale and stale not in listed_doc_ids:
+                writer.set(collection.document(stale), {"delisted": True}, merge=True)
+                paths.append(collection.document(stale).path)
+            self._pending[school["uni_id"]] = (paths, state)
+        return len(self._pending)
+
+    def save_synced(self, writer):
+        # Schools with a failed write stay pending, so the next sync retries them
+        failed = {path for path, _ in writer.failures}
+        with self._conn() as conn:
+            for uni_id, (paths, (name, doc_id, delisted)) in self._pending.items():
+                if failed.isdisjoint(paths):
+                    conn.execute("UPDATE schools SET synced_name = COALESCE(?, synced_name), synced_doc_id = ?, "
+                                 "synced_delisted = ?, resync = 0 WHERE uni_id = ?", (name, doc_id, delisted, uni_id))
+        self._pending.clear()
+
+    def resync(self):
+        """Flag every listed school, so the next sync() rewrites it whatever the fingerprints say."""
+        with self._conn() as conn:
+            conn.execute("UPDATE schools SET resync = 1 WHERE removed_in IS NULL")
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+from records import to_datetime
+
+DEFAULT_PATH = "crawl_checkpoints.json"
+
+# Outcomes of CheckpointStore.classify
+NEW = "new"              # never seen: fetch the thread
+CHANGED = "changed"      # reply count moved: re-fetch the thread
+UNCHANGED = "unchanged"  # nothing new: skip the thread
+PROBE = "probe"          # known, but the listing has no reply count: check the last page
+
+def _iso(dt):
+    return dt.isoformat() if dt else None
+
+def _parse_iso(value):
+    return datetime.fromisoformat(value) if value else None
+
+# ---------------------- Checkpoint Store ----------------------
+class CheckpointStore:
+    """Per-school high-water marks persisted as JSON between runs.
+
+    For each uni_id we keep the newest post date seen and, per thread URL,
+    the listing counters plus how many pages / comments the thread had the
+    last time it was fetched. Incremental runs use that to stop listing
+    pagination early and to skip threads with no new activity.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self._state = json.load(f)
+        else:
+            self._state = {}
+
+    def _school(self, uni_id):
+        return self._state.setdefault(str(uni_id), {"newest_post_date": None, "threads": {}})
+
+    def newest_post_date(self, uni_id):
+        with self._lock:
+            return _parse_iso(self._school(uni_id)["newest_post_date"])
+
+    def thread(self, uni_id, post_url):
+        with self._lock:
+            state = self._school(uni_id)["threads"].get(post_url)
+            return dict(state) if state else None
+
+    def classify(self, uni_id, entry):
+        state = self.thread(uni_id, entry["post_url"])
+        if state is None:
+            return NEW
+        if entry.get("replies") is None or state.get("replies") is None:
+            return PROBE
+        return UNCHANGED if entry["replies"] == state["replies"] else CHANGED
+
+    def counters_changed(self, uni_id, entry):
+        state = self.thread(uni_id, entry["post_url"]) or {}
+        return any(state.get(key) != entry[key] for key in ("views", "upvotes", "downvotes"))
+
+    def record_thread(self, uni_id, entry, pages=None, last_page_comments=None, comment_count=None,
+                      last_comment_date=None):
+        """Remember a thread's listing counters and, after a fetch, its shape."""
+        with self._lock:
+            school = self._school(uni_id)
+            state = school["threads"].setdefault(entry["post_url"], {})
+            state.update({
+                "date": _iso(entry["date"]),
+                "replies": entry.get("replies"),
+                "views": entry["views"],
+                "upvotes": entry["upvotes"],
+                "downvotes": entry["downvotes"],
+            })
+            if pages is not None:
+                state.update({
+                    "pages": pages,
+                    "last_page_comments": last_page_comments,
+                    "comment_count": comment_count,
+                    "last_comment_date": _iso(last_comment_date),
+                })
+            newest = _parse_iso(school["newest_post_date"])
+            if entry["date"] and (newest is None or entry["date"] > newest):
+                school["newest_post_date"] = _iso(entry["date"])
+
+    def prune(self, uni_id, cutoff):
+        # Threads that fell out of the crawl window will never be revisited
+        with self._lock:
+            threads = self._school(uni_id)["threads"]
+            for post_url in [url for url, state in threads.items()
+                             if state.get("date") and _parse_iso(state["date"]) < cutoff]:
+                del threads[post_url]
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self._state, indent=1, sort_keys=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+def last_comment_date(comments):
+    timestamps = [c.timestamp for c in comments if c.timestamp]
+    return to_datetime(max(timestamps)) if timestamps else None
+
+def probe_unchanged(state, last_page):
+    """Compare a fresh parse of a thread's last known page with its checkpoint.
+
+    `last_page` is the tuple from parse_thread_page,
+    or None when the page could not be fetched.
+    """
+    if last_page is None or not state.get("pages"):
+        return False
+    _, comments, has_next, _ = last_page
+    return not has_next and len(comments) == state.get("last_page_comments")
@@ -0,0 +1,480 @@
+import time
+
+# Taken before anything else is imported; see report_startup()
+STARTED = time.perf_counter()
+
+import argparse
+import re
+import sys
+
+# Stdlib-only modules; everything heavier is imported inside the commands, so
+# `cli.py --help` stays instant, --dry-run never loads Firestore and each
+# subcommand only loads what it uses
+import comment_store
+from fingerprints import DEFAULT_PATH as DEFAULT_FINGERPRINTS, FingerprintStore
+from schedule import DEFAULT_PATH as DEFAULT_ACTIVITY, ActivityStore, Scheduler
+from search_index import DEFAULT_HASH_PATH, SearchIndexHashes
+
+STARTUP_TARGET = 0.5  # seconds from importing this module to the first request
+
+# ---------------------- Shared Options ----------------------
+def add_fetch_options(parser):
+    parser.add_argument("--rate", type=float, default=2.0, help="requests per second to greekrank.com")
+    parser.add_argument("--burst", type=float, default=4, help="token bucket size for --rate")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="start at --rate and tune rate and concurrency from latency and errors (AIMD)")
+    parser.add_argument("--min-rate", type=float, default=0.25, help="rate floor for --adaptive")
+    parser.add_argument("--max-rate", type=float, default=10.0, help="rate ceiling for --adaptive")
+    parser.add_argument("--concurrency", type=int, default=8, help="max in-flight requests")
+    parser.add_argument("--max-concurrency", type=int, default=16, help="concurrency ceiling for --adaptive")
+    parser.add_argument("--cache-dir", help="cache responses on disk here (conditional GETs on reruns)")
+    parser.add_argument("--cache-ttl", type=float, default=3600, help="seconds before a cached page is revalidated")
+    parser.add_argument("--offline", action="store_true", help="replay --cache-dir only, never hit the network")
+
+def add_output_options(parser):
+    parser.add_argument("--dry-run", action="store_true", help="scrape and count, but write nothing anywhere")
+    parser.add_argument("--sink", choices=("firestore", "jsonl", "parquet"), default="firestore",
+                        help="write to Firestore, or export partitioned gzipped JSONL or Parquet files")
+    parser.add_argument("--out", help="export directory for --sink jsonl/parquet")
+    parser.add_argument("--comments", choices=comment_store.MODES, default=comment_store.EMBEDDED,
+                        help="store comments in the post document, a comments subcollection or chunk documents")
+    parser.add_argument("--comment-log", default=comment_store.DEFAULT_LOG_PATH,
+                        help="comment IDs already written, so later runs only append new ones")
+    parser.add_argument("--fingerprints", default=DEFAULT_FINGERPRINTS,
+                        help="content fingerprints of written documents; unchanged ones are skipped")
+    parser.add_argument("--no-fingerprints", action="store_true", help="write every document, changed or not")
+    parser.add_argument("--index-hashes", default=DEFAULT_HASH_PATH,
+                        help="file of school name hashes; search fields are only rewritten when a name changes")
+    add_catalog_options(parser)
+
+def add_catalog_options(parser):
+    parser.add_argument("--catalog", default="school_catalog.db",
+                        help="local snapshot of /list/; only added, renamed or removed schools are written")
+    parser.add_argument("--no-catalog", action="store_true", help="parse /list/ and write every school each run")
+
+def add_metrics_options(parser):
+    parser.add_argument("--base-url", help="scrape this site instead of greekrank.com (e.g. a bench.py stub)")
+    parser.add_argument("--metrics-file", help="write Prometheus metrics here (textfile collector format)")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics at :PORT/metrics")
+    parser.add_argument("--json-log", help="append structured JSON log lines here")
+    parser.add_argument("--trace", help="append one JSON span per school and per post here")
+    parser.add_argument("--startup-target", type=float, default=STARTUP_TARGET,
+                        help="warn when import-to-first-request takes longer than this many seconds")
+
+class Session:
+    """What a subcommand sets up from the shared options: fetching, and where output goes."""
+
+    def __init__(self, args):
+        import http_client
+        import metrics
+        import parsers
+
+        self.args = args
+        if args.base_url:
+            parsers.BASE_URL = args.base_url.rstrip("/")
+        metrics.configure(json_log=args.json_log, trace=args.trace, textfile=args.metrics_file,
+                          port=args.metrics_port)
+
+        # One limiter for the whole process: http_client and the Crawler share its per-host budget
+        self.concurrency = args.concurrency
+        if args.adaptive:
+            from rate_limit import AdaptiveRateLimiter
+
+            self.limiter = AdaptiveRateLimiter(rate=args.rate, min_rate=args.min_rate, max_rate=args.max_rate,
+                                               concurrency=min(args.concurrency, args.max_concurrency),
+                                               max_concurrency=args.max_concurrency)
+            self.concurrency = max(args.concurrency, args.max_concurrency)  # the limiter decides how much is used
+        else:
+            from rate_limit import HostRateLimiter
+
+            self.limiter = HostRateLimiter(rate=args.rate, capacity=args.burst)
+
+        self.cache = None
+        if args.cache_dir:
+            from http_cache import HttpCache
+
+            self.cache = HttpCache(args.cache_dir, ttl=args.cache_ttl, offline=args.offline)
+        # Every subcommand fetches at --rate/--burst over --concurrency connections, not the library defaults
+        http_client.configure(cache=self.cache, pool_size=self.concurrency, limiter=self.limiter)
+
+        self.fingerprints = None
+        self.index_hashes = None
+        self.catalog = None
+
+    @property
+    def writes_firestore(self):
+        return not self.args.dry_run and self.args.sink == "firestore"
+
+    def open_sink(self):
+        import sinks
+
+        args = self.args
+        if args.dry_run:
+            return sinks.DryRunSink()
+        if args.sink != "firestore":
+            return sinks.open_sink(args.sink, args.out)
+
+        from firestore_writer import configure_writer
+
+        comment_store.configure(args.comments, args.comment_log)
+        self.fingerprints = None if args.no_fingerprints else FingerprintStore(args.fingerprints)
+        configure_writer(fingerprints=self.fingerprints)
+        self.index_hashes = SearchIndexHashes(args.index_hashes)
+        return sinks.FirestoreSink(index_hashes=self.index_hashes)
+
+    def open_catalog(self):
+        if self.catalog is None and not self.args.no_catalog:
+            from catalog import Catalog
+
+            self.catalog = Catalog(self.args.catalog, in_memory=self.args.dry_run)
+        return self.catalog
+
+    def fetch_schools(self):
+        """Every school on /list/; with the catalog, /list/ is only parsed when it changed."""
+        import parsers
+
+        url = f"{parsers.BASE_URL}/list/"
+        catalog = self.open_catalog()
+        if catalog is None:
+            from scrape import fetch_schools
+
+            return fetch_schools(url)
+        changes = catalog.refresh(url)
+        version = catalog.version()
+        if changes:
+            counts = {}
+            for change in changes:
+                counts[change.kind] = counts.get(change.kind, 0) + 1
+            print(f"School catalog v{version['version']}: {counts}")
+        else:
+            print(f"School catalog v{version['version']} is current ({version['schools']} schools).")
+        return catalog.schools()
+
+    def find_school(self, uni_id):
+        # The catalog answers without a request unless the school is new since the last refresh
+        catalog = self.open_catalog()
+        school = catalog.school(uni_id) if catalog is not None else None
+        if school is None:
+            school = next((s for s in self.fetch_schools() if s["uni_id"] == uni_id), None)
+        if school is None:
+            raise SystemExit(f"No school with uni_id {uni_id} on /list/")
+        return school
+
+    def write_schools(self, schools):
+        """Queue the school documents: just the catalog's changes, or all of them without one."""
+        if self.catalog is not None:
+            print(f"Queued {self.catalog.sync(index_hashes=self.index_hashes)} changed schools.")
+            return
+        from scrape import add_school_to_firestore
+
+        for school in schools:
+            add_school_to_firestore(school, index_hashes=self.index_hashes)
+
+    def finish(self, sink=None):
+        """Close the sink, save the Firestore side files and print the run's numbers."""
+        import http_client
+        import metrics
+
+        if self.writes_firestore:
+            from firestore_writer import get_writer
+            from scrape import save_comment_log, save_index_hashes
+
+            writer = get_writer()
+            writer.close()
+            save_index_hashes(self.index_hashes, writer)
+            save_comment_log(writer)
+            if self.catalog is not None:
+                self.catalog.save_synced(writer)
+            if self.fingerprints:
+                self.fingerprints.save()
+            print(f"Firestore writes: {writer.summary()}")
+            for path, error in writer.failures:
+                print(f"  failed: {path}: {error}")
+        elif sink is not None:
+            sink.close()
+            print(f"{'Dry run' if self.args.dry_run else 'Exported'}: {sink.summary()}")
+        print(f"Fetch stats: {http_client.get_client().stats.summary()}")
+        if self.cache:
+            print(f"Cache: {self.cache.summary()}")
+        if self.args.adaptive:
+            print(f"Adaptive limits: {self.limiter.current()}")
+        report_startup(self.args.startup_target)
+        metrics.close()
+
+def report_startup(target=STARTUP_TARGET):
+    import http_client
+    import metrics
+
+    if http_client.first_request_at is None:
+        return None
+    startup = http_client.first_request_at - STARTED
+    metrics.gauge("greekrank_startup_seconds", startup)
+    print(f"Startup: {startup * 1000:.1f} ms from import to first request (target {target * 1000:.0f} ms)")
+    if startup > target:
+        print("Warning: startup is over target; check for new import-time work (python -X importtime cli.py ...).")
+    return startup
+
+# ---------------------- Commands ----------------------
+def cmd_schools(args):
+    """Every school on /list/ into the sink (what add_schools.py used to do)."""
+    session = Session(args)
+    sink = session.open_sink()
+    schools = session.fetch_schools()
+    if session.writes_firestore:
+        session.write_schools(schools)
+    else:
+        for school in schools:
+            sink.write_school(school)
+    print(f"Found {len(schools)} schools.")
+    session.finish(sink)
+
+def _plan(args, all_schools):
+    # (schools to crawl, ActivityStore or None); --schedule keeps only the due ones, busiest first
+    if not args.schedule:
+        return all_schools, None
+    activity = ActivityStore(args.activity)
+    planned = Scheduler(activity).plan(all_schools, budget=args.budget)
+    print(f"Scheduled {len(planned)} of {len(all_schools)} schools"
+          f"{f' within a budget of {args.budget} requests' if args.budget else ''}.")
+    return planned, activity
+
+def _save_activity(activity, all_schools):
+    if activity is None:
+        return
+    activity.save()
+    wait = Scheduler(activity).next_due(all_schools)
+    if wait is not None:
+        print(f"Next school due in {wait / 60:.0f} minutes.")
+
+def cmd_posts(args):
+    """Recent posts of every school (what scrape.py's __main__ used to do)."""
+    import asyncio
+    from crawler import Crawler
+
+    if args.offline and not args.cache_dir:
+        raise SystemExit("--offline needs --cache-dir")
+    if args.schedule and args.queue:
+        raise SystemExit("--schedule works with the crawler, not --queue")
+    if (args.dry_run or args.sink != "firestore") and (args.queue or args.incremental):
+        # Exports stream every post; checkpoints and the queue only track Firestore writes
+        raise SystemExit("--queue and --incremental only work when writing to Firestore")
+    session = Session(args)
+    sink = session.open_sink()
+
+    if not session.writes_firestore:
+        # Export or dry run: stream every record into the sink, no Firestore client or credentials
+        print("Fetching all schools...")
+        all_schools = session.fetch_schools()
+        schools, activity = _plan(args, all_schools)
+        crawler = Crawler(None, concurrency=session.concurrency, school_concurrency=args.school_concurrency,
+                          rate=args.rate, burst=args.burst, parse_workers=args.parse_workers,
+                          cache=session.cache, limiter=session.limiter, activity=activity)
+
+        async def export():
+            async for record in crawler.stream(schools):
+                sink.write_record(record)
+
+        asyncio.run(export())
+        print(f"Crawl fetch stats: {crawler.client.stats.summary()}")
+        _save_activity(activity, all_schools)
+        session.finish(sink)
+        return
+
+    from checkpoints import CheckpointStore
+    from scrape import school_doc_id, school_doc_ref_for, update_post_counters, upload_single_post_to_firestore
+
+    checkpoints = CheckpointStore(args.checkpoints) if args.incremental else None
+    if args.queue:
+        from queue_crawl import QueueCrawl, report, run_workers
+        from work_queue import IN_FLIGHT, PENDING, WorkQueue
+
+        queue = WorkQueue(args.queue)
+        crawl = QueueCrawl(queue, checkpoints=checkpoints)
+        counts = queue.counts()
+        if counts[PENDING] or counts[IN_FLIGHT]:
+            print(f"Resuming queue {args.queue}: {counts}")
+        else:
+            if any(counts.values()):
+                # Task keys repeat from run to run, so a finished run has to be cleared before reseeding
+                print(f"Last run in {args.queue} finished ({counts}); starting a new one.")
+                queue.clear()
+            print("Fetching all schools...")
+            all_schools = session.fetch_schools()
+            session.write_schools(all_schools)
+            print(f"Queued {crawl.seed(all_schools, school_doc_id)} schools.")
+        run_workers(crawl, threads=args.queue_threads)
+        session.finish()
+        report(queue)
+        return
+
+    print("Fetching all schools...")
+    all_schools = session.fetch_schools()
+    session.write_schools(all_schools)
+
+    schools, activity = _plan(args, all_schools)
+    print("Starting to scrape posts for all schools...")
+    crawler = Crawler(upload_single_post_to_firestore, concurrency=session.concurrency,
+                      school_concurrency=args.school_concurrency, rate=args.rate, burst=args.burst,
+                      checkpoints=checkpoints,
+                      update_counters=update_post_counters, parse_workers=args.parse_workers,
+                      cache=session.cache, limiter=session.limiter, activity=activity)
+    asyncio.run(crawler.run(schools, school_doc_ref_for))
+    print(f"Crawl fetch stats: {crawler.client.stats.summary()}")
+    _save_activity(activity, all_schools)
+    session.finish()
+    print("All scraping tasks completed.")
+
+def cmd_school(args):
+    """Recent posts of one school, e.g. `school 62` for the University of Michigan."""
+    import stream
+
+    session = Session(args)
+    sink = session.open_sink()
+    school = session.find_school(args.uni_id)
+    print(f"Scraping posts from GreekRank for {school['name']} (uni_id: {args.uni_id})...")
+    sink.write_record(stream.school_record(school))
+    posts = 0
+    for record in stream.iter_posts(args.uni_id, prefetch=args.prefetch):
+        sink.write_record(record)
+        posts += record["kind"] == stream.POST_END
+    print(f"Found {posts} posts from the last 2 weeks.")
+    session.finish(sink)
+
+def _thread_entry(uni_id, post_url, partial=True):
+    # The listing entry has the title, author, date and counters; a thread page alone doesn't
+    import stream
+    from parsers import thread_id
+
+    target = thread_id(post_url)
+    for entry in stream.iter_listing(uni_id):
+        if thread_id(entry["post_url"]) == target:
+            return entry
+    if not partial:
+        # The app sorts and filters posts by date, so a Firestore post without one would be broken
+        raise SystemExit("Thread not among the school's recent listings, so it has no date, author or counters; "
+                         "export it with --sink or --dry-run instead of writing it to Firestore")
+    print("Thread not among the school's recent listings; storing it without listing details.")
+    slug = post_url.rstrip("/").rsplit("/", 1)[-1]
+    return {"title": slug.replace("-", " ").capitalize(), "post_url": post_url, "snippet": None, "author": None,
+            "date": None, "views": None, "upvotes": None, "downvotes": None, "replies": None}
+
+def cmd_thread(args):
+    """One thread and all its comment pages."""
+    import stream
+
+    uni_id = args.uni_id
+    if uni_id is None:
+        match = re.search(r"/uni/(\d+)/", args.post_url)
+        if not match:
+            raise SystemExit("Can't tell the school from the URL; pass --uni-id")
+        uni_id = match.group(1)
+
+    session = Session(args)
+    if session.writes_firestore and not args.listing:
+        raise SystemExit("Writing a thread to Firestore needs its listing details; drop --no-listing")
+    if args.listing:
+        entry = _thread_entry(uni_id, args.post_url, partial=not session.writes_firestore)
+    else:
+        entry = {"title": None, "post_url": args.post_url, "snippet": None, "author": None, "date": None,
+                 "views": None, "upvotes": None, "downvotes": None, "replies": None}
+    sink = session.open_sink()
+    if session.writes_firestore:
+        # The post document lives under its school's document
+        sink.write_record(stream.school_record(session.find_school(uni_id)))
+    for record in stream.thread_records(uni_id, entry, stream.iter_thread_pages(args.post_url, args.prefetch)):
+        sink.write_record(record)
+    session.finish(sink)
+
+def cmd_catalog(args):
+    """Look schools up in the local catalog snapshot (uni_id, document ID, name prefix)."""
+    from catalog import Catalog
+
+    catalog = Catalog(args.catalog)
+    if args.resync:
+        catalog.resync()
+        print("Every school will be rewritten on the next Firestore run.")
+    if args.refresh or catalog.version() is None:
+        session = Session(args)
+        session.catalog = catalog
+        session.fetch_schools()
+    if args.uni_id:
+        matches = [school for school in [catalog.school(args.uni_id)] if school]
+    elif args.slug:
+        matches = catalog.by_slug(args.slug)
+    elif args.prefix:
+        matches = catalog.search(args.prefix, limit=args.limit)
+    else:
+        version = catalog.version()
+        print(f"School catalog v{version['version']}: {version['schools']} schools "
+              f"(list hash {version['list_hash'][:12]})")
+        for change in catalog.changes(version["version"])[:args.limit]:
+            print(f"  {change.kind:<8} {change.uni_id:>6}  {change.old_name or ''} -> {change.new_name or ''}")
+        return
+    for school in matches:
+        print(f"{school['uni_id']:>6}  {school['doc_id']:<40}  {school['name']}")
+    if not matches:
+        raise SystemExit("No matching school.")
+
+# ---------------------- Entry Point ----------------------
+def build_parser():
+    parser = argparse.ArgumentParser(description="Scrape GreekRank schools, posts and comments.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    schools = commands.add_parser("schools", help="every school on /list/")
+    schools.set_defaults(run=cmd_schools)
+
+    posts = commands.add_parser("posts", help="recent posts of every school")
+    posts.add_argument("--school-concurrency", type=int, default=4, help="schools crawled at once")
+    posts.add_argument("--parse-workers", type=int, default=None,
+                       help="parser processes (default: one per core, 0 parses inline)")
+    posts.add_argument("--incremental", action="store_true",
+                       help="only fetch threads with new activity since the last run")
+    posts.add_argument("--checkpoints", default="crawl_checkpoints.json", help="checkpoint file for --incremental")
+    posts.add_argument("--queue", help="run from a durable SQLite work queue, resuming it if it already has tasks")
+    posts.add_argument("--queue-threads", type=int, default=4, help="worker threads for --queue")
+    posts.add_argument("--schedule", action="store_true",
+                       help="crawl only the schools that are due, busiest first, from their activity history")
+    posts.add_argument("--activity", default=DEFAULT_ACTIVITY, help="per-school activity history for --schedule")
+    posts.add_argument("--budget", type=int, help="with --schedule, stop planning schools past about this many requests")
+    posts.set_defaults(run=cmd_posts)
+
+    school = commands.add_parser("school", help="recent posts of one school")
+    school.add_argument("uni_id", help="GreekRank school number, e.g. 62")
+    school.add_argument("--prefetch", type=int, default=2, help="thread pages fetched ahead")
+    school.set_defaults(run=cmd_school)
+
+    thread = commands.add_parser("thread", help="one thread with all its comments")
+    thread.add_argument("post_url", help="thread URL, e.g. https://www.greekrank.com/uni/62/discussion/12345/...")
+    thread.add_argument("--uni-id", help="school number (default: taken from the URL)")
+    thread.add_argument("--no-listing", dest="listing", action="store_false",
+                        help="don't look the thread up on the school's listing pages (title, author, date)")
+    thread.add_argument("--prefetch", type=int, default=2, help="thread pages fetched ahead")
+    thread.set_defaults(run=cmd_thread)
+
+    for command in (schools, posts, school, thread):
+        add_fetch_options(command)
+        add_output_options(command)
+        add_metrics_options(command)
+
+    catalog = commands.add_parser("catalog", help="look schools up in the local /list/ snapshot")
+    catalog.add_argument("--uni-id", help="the school with this number")
+    catalog.add_argument("--slug", help="schools stored under this Firestore document ID")
+    catalog.add_argument("--prefix", help="schools whose name starts with this")
+    catalog.add_argument("--limit", type=int, default=20, help="most results for --prefix")
+    catalog.add_argument("--refresh", action="store_true", help="check /list/ for changes first")
+    catalog.add_argument("--resync", action="store_true", help="rewrite every school on the next Firestore run")
+    catalog.add_argument("--catalog", default="school_catalog.db", help="catalog database")
+    catalog.set_defaults(run=cmd_catalog)
+    add_fetch_options(catalog)
+    add_metrics_options(catalog)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "sink", "firestore") != "firestore" and not args.dry_run and not args.out:
+        parser.error(f"--sink {args.sink} needs --out")
+    args.run(args)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
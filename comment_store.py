@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from records import as_dict
+
+DEFAULT_LOG_PATH = "comment_log.json"
+
+# Where a post's comments live
+EMBEDDED = "embedded"          # a `comments` array on the post document (the original layout)
+SUBCOLLECTION = "subcollection"  # posts/{post}/comments/{comment id}
+CHUNKS = "chunks"              # posts/{post}/comment_chunks/{n}, CHUNK_SIZE comments per document
+MODES = (EMBEDDED, SUBCOLLECTION, CHUNKS)
+
+CHUNK_SIZE = 200  # comfortably under the 1 MiB document limit for typical replies
+
+# ---------------------- Comment IDs ----------------------
+def comment_hash(comment):
+    date = comment["date"].isoformat() if hasattr(comment["date"], "isoformat") else comment["date"]
+    key = "\x1f".join((comment["author"] or "", date or "", comment["content"] or ""))
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def comment_ids(comments):
+    """Stable IDs for a thread's comments, in order.
+
+    The ID hashes author, date and content; identical repeats in one thread
+    (a "bump" posted twice in the same second) get a -2, -3... suffix.
+    """
+    seen = {}
+    ids = []
+    for comment in comments:
+        digest = comment_hash(comment)
+        seen[digest] = seen.get(digest, 0) + 1
+        ids.append(digest if seen[digest] == 1 else f"{digest}-{seen[digest]}")
+    return ids
+
+# ---------------------- Comment Log ----------------------
+class CommentLog:
+    """Which comment IDs have been written for each post document, persisted as JSON.
+
+    Lets later runs append only the new comments. Losing the file is
+    harmless: every comment is simply written again under the same ID.
+    """
+
+    def __init__(self, path=DEFAULT_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self._posts = json.load(f)
+        else:
+            self._posts = {}
+
+    def known(self, post_path):
+        with self._lock:
+            state = self._posts.get(post_path)
+            return list(state["ids"]) if state else []
+
+    def record(self, post_path, ids):
+        with self._lock:
+            self._posts[post_path] = {"ids": list(ids), "seen": time.time()}
+
+    def forget_failed(self, failures):
+        # Any failed write under a post makes the next run rewrite that post's comments
+        with self._lock:
+            for path, _ in failures:
+                for post_path in [p for p in self._posts if path == p or path.startswith(p + "/")]:
+                    del self._posts[post_path]
+
+    def prune(self, max_age=30 * 24 * 3600):
+        cutoff = time.time() - max_age
+        with self._lock:
+            for post_path in [p for p, state in self._posts.items() if state["seen"] < cutoff]:
+                del self._posts[post_path]
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self._posts)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+_mode = EMBEDDED
+_log = None
+
+def configure(mode=EMBEDDED, log_path=DEFAULT_LOG_PATH):
+    """Pick where upload_single_post_to_firestore puts comments; returns the CommentLog, if any."""
+    global _mode, _log
+    if mode not in MODES:
+        raise ValueError(f"Unknown comment storage {mode!r}; expected one of {MODES}")
+    _mode = mode
+    _log = CommentLog(log_path) if mode != EMBEDDED else None
+    return _log
+
+def get_mode():
+    return _mode
+
+def get_log():
+    return _log
+
+# ---------------------- Writes ----------------------
+def _comment_doc(comment, index):
+    return {"author": comment["author"], "date": comment["date"], "content": comment["content"], "index": index}
+
+def write_post(post, post_ref, writer, mode=None, log=None):
+    """Queue a post document plus whichever of its comments haven't been written yet.
+
+    In SUBCOLLECTION and CHUNKS mode the post document gets `commentCount`
+    and `commentStorage` instead of the `comments` array. Returns how many
+    comment writes were queued.
+    """
+    mode = mode or _mode
+    log = log if log is not None else _log
+    post = as_dict(post)  # Firestore stores plain dicts and datetimes, not records.Post
+    if mode == EMBEDDED:
+        writer.set(post_ref, post)
+        return 0
+
+    comments = post["comments"]
+    ids = comment_ids(comments)
+    known = set(log.known(post_ref.path)) if log else set()
+    new = [(index, comment_id) for index, comment_id in enumerate(ids) if comment_id not in known]
+
+    # No merge: a post written in EMBEDDED mode earlier loses its comments array here
+    writer.set(post_ref, {**{key: value for key, value in post.items() if key != "comments"},
+                          "commentCount": len(comments), "commentStorage": mode})
+    if mode == SUBCOLLECTION:
+        for index, comment_id in new:
+            writer.set(post_ref.collection("comments").document(comment_id), _comment_doc(comments[index], index))
+    else:
+        # Comments keep their thread position, so appends only touch the last chunk or two;
+        # merge keeps the comments already in the chunk
+        chunks = {}
+        for index, comment_id in new:
+            chunks.setdefault(index // CHUNK_SIZE, {})[comment_id] = _comment_doc(comments[index], index)
+        for number, chunk in sorted(chunks.items()):
+            writer.set(post_ref.collection("comment_chunks").document(f"{number:05d}"),
+                       {"first_index": number * CHUNK_SIZE, "comments": chunk}, merge=True)
+
+    if log:
+        log.record(post_ref.path, ids)
+    return len(new)
@@ -0,0 +1,346 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from requests import RequestException
+
+from checkpoints import PROBE, UNCHANGED, last_comment_date, probe_unchanged
+from dedup import SeenThreads
+from http_client import DEFAULT_TIMEOUT, HttpClient
+import metrics
+from parsers import assemble_thread, build_post, listing_page_url, thread_page_url
+from pipeline import ParsePipeline
+from rate_limit import HostRateLimiter
+from stream import POST_END, ThreadRecords, school_record
+
+# ---------------------- Async Crawl Engine ----------------------
+class Crawler:
+    """Fetch many schools and threads at once.
+
+    Requests go through a pooled HttpClient on a dedicated thread pool; raw
+    pages are parsed in a process pool and uploads run in a writer stage,
+    see pipeline.ParsePipeline. Two knobs bound the load:
+    `concurrency` caps in-flight requests overall and `rate`/`burst` feed a
+    per-host token bucket that replaces the old fixed time.sleep(1) calls.
+    The bucket is charged per attempt, so retries stay within the budget too.
+    Pass `limiter` (e.g. a rate_limit.AdaptiveRateLimiter) to replace the bucket.
+
+    Passing a CheckpointStore makes the crawl incremental, the same way as
+    scrape.scrape_greekrank_posts; `update_counters(entry, school_doc_ref)`
+    then refreshes views/votes on threads that are otherwise skipped.
+    With a schedule.ActivityStore, every finished school's listing entries
+    and request count are recorded for the Scheduler.
+    """
+
+    def __init__(self, upload_post, concurrency=8, school_concurrency=4, rate=2.0, burst=4,
+                 cutoff=None, timeout=DEFAULT_TIMEOUT, checkpoints=None, update_counters=None,
+                 parse_workers=None, cache=None, limiter=None, activity=None):
+        self.upload_post = upload_post
+        self.checkpoints = checkpoints
+        self.activity = activity
+        self.update_counters = update_counters
+        self.concurrency = concurrency
+        self.school_concurrency = school_concurrency
+        self.limiter = limiter or HostRateLimiter(rate=rate, capacity=burst)
+        self.client = HttpClient(pool_size=concurrency, timeout=timeout, limiter=self.limiter, cache=cache)
+        self.cutoff = cutoff or datetime.now(timezone.utc) - timedelta(weeks=2)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fetch")
+        self.pipeline = ParsePipeline(workers=parse_workers)
+        self.seen = SeenThreads()
+        self._slots = None
+
+    async def fetch(self, url):
+        # Returns (status_code, response); response is None for non-200 responses
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(self._executor, self.client.get, url)
+        if response.status_code != 200:
+            return response.status_code, None
+        return response.status_code, response
+
+    async def fetch_thread_page(self, post_url, page_number):
+        status, response = await self.fetch(thread_page_url(post_url, page_number))
+        if response is None:
+            return None
+        return await self.pipeline.parse("thread", response, first_page=page_number == 1)
+
+    async def scrape_thread(self, post_url):
+        # Same contract as scrape.scrape_thread: pages 2..N in parallel when page 1 gives N
+        pages = [await self.fetch_thread_page(post_url, 1)]
+        if pages[0] is not None:
+            _, _, has_next, last_page = pages[0]
+            if has_next and last_page:
+                pages += await asyncio.gather(*(self.fetch_thread_page(post_url, n)
+                                                for n in range(2, last_page + 1)))
+
+        while None not in pages and pages[-1][2]:
+            pages.append(await self.fetch_thread_page(post_url, len(pages) + 1))
+
+        return assemble_thread(pages)
+
+    async def stream_thread_pages(self, post_url, prefetch=2):
+        """Async iterator over a thread's parsed pages with at most `prefetch` fetched ahead."""
+        page = await self.fetch_thread_page(post_url, 1)
+        if page is None:
+            return
+        yield page
+        number = 1
+        if page[2] and page[3]:
+            numbers = iter(range(2, page[3] + 1))
+            pending = deque(asyncio.ensure_future(self.fetch_thread_page(post_url, n))
+                            for n in islice(numbers, max(prefetch, 1)))
+            try:
+                while pending:
+                    page = await pending.popleft()
+                    n = next(numbers, None)
+                    if n is not None:
+                        pending.append(asyncio.ensure_future(self.fetch_thread_page(post_url, n)))
+                    if page is None:
+                        return
+                    number += 1
+                    yield page
+            finally:
+                for task in pending:
+                    task.cancel()
+        while page[2]:
+            number += 1
+            page = await self.fetch_thread_page(post_url, number)
+            if page is None:
+                return
+            yield page
+
+    async def stream_thread(self, uni_id, entry, prefetch=2):
+        # Async twin of stream.thread_records
+        builder = ThreadRecords(uni_id, entry)
+        pages = self.stream_thread_pages(entry["post_url"], prefetch)
+        page = await anext(pages, None)
+        yield builder.start(page)
+        while page is not None:
+            for record in builder.page(page):
+                yield record
+            page = await anext(pages, None)
+        yield builder.end()
+
+    async def scrape_post_details(self, post_url):
+        main_post_content, comments, _, _ = await self.scrape_thread(post_url)
+        return main_post_content, comments
+
+    async def _thread_is_unchanged(self, uni_id, entry):
+        action = self.checkpoints.classify(uni_id, entry)
+        if action == PROBE:
+            state = self.checkpoints.thread(uni_id, entry["post_url"])
+            try:
+                page = await self.fetch_thread_page(entry["post_url"], state.get("pages") or 1)
+            except RequestException:
+                return False  # let _scrape_and_upload try the thread and skip it if it still fails
+            return probe_unchanged(state, page)
+        return action == UNCHANGED
+
+    async def _scrape_and_upload(self, uni_id, entry, school_doc_ref):
+        try:
+            with metrics.span("post", uni_id=uni_id, post_url=entry["post_url"]):
+                full_content, comments, pages, last_page_comments = await self.scrape_thread(entry["post_url"])
+        except RequestException as e:
+            # Don't upload a thread with missing comment pages (FetchError, or CacheMiss with --offline)
+            print(f"Skipping post '{entry['title']}': {e}")
+            metrics.log("post_skipped", uni_id=uni_id, post_url=entry["post_url"], error=str(e))
+            return 0
+        new_post = build_post(entry, full_content, comments)
+        await self.pipeline.emit(self.upload_post, new_post, school_doc_ref)
+        if self.checkpoints:
+            self.checkpoints.record_thread(uni_id, entry, pages, last_page_comments, len(comments),
+                                           last_comment_date(comments))
+        return pages
+
+    async def _select_entries(self, uni_id, entries, checkpoint, school_doc_ref):
+        """Split a listing page into threads to fetch; the flag says whether to stop paginating."""
+        candidates = []
+        stop = False
+        for entry in entries:
+            # Listings are newest first, so everything after the first stale post is stale too
+            if not self._in_window(entry):
+                print(f"Reached posts older than two weeks for uni_id {uni_id}. Stopping.")
+                stop = True
+                break
+            if self.seen.claim(entry["post_url"]):
+                candidates.append(entry)
+
+        if not self.checkpoints:
+            return candidates, stop
+
+        unchanged = await asyncio.gather(*(self._thread_is_unchanged(uni_id, entry) for entry in candidates))
+        selected = []
+        for entry, is_unchanged in zip(candidates, unchanged):
+            if not is_unchanged:
+                selected.append(entry)
+                continue
+            if self.update_counters and self.checkpoints.counters_changed(uni_id, entry):
+                await self.pipeline.emit(self.update_counters, entry, school_doc_ref)
+                self.checkpoints.record_thread(uni_id, entry)
+            if checkpoint and entry["date"] <= checkpoint:
+                print(f"Reached the last checkpoint for uni_id {uni_id}. Stopping.")
+                return selected, True
+        return selected, stop
+
+    def _in_window(self, entry):
+        return entry["post_url"] and entry["date"] and entry["date"] >= self.cutoff
+
+    async def scrape_school(self, uni_id, school_doc_ref):
+        checkpoint = self.checkpoints.newest_post_date(uni_id) if self.checkpoints else None
+        seen_entries = []
+        requests = 0
+        page = 1
+        while True:
+            status, response = await self.fetch(listing_page_url(uni_id, page))
+            requests += 1
+            if response is None:
+                print(f"Failed to retrieve page {page} for uni_id {uni_id}. Status code: {status}")
+                break
+
+            parsed = await self.pipeline.parse("listing", response)
+            if parsed is None:
+                print(f"No discussion boxes found on page {page} for uni_id {uni_id}.")
+                break
+            entries, has_next = parsed
+            seen_entries += [entry for entry in entries if self._in_window(entry)]
+
+            selected, stop = await self._select_entries(uni_id, entries, checkpoint, school_doc_ref)
+            requests += sum(await asyncio.gather(*(self._scrape_and_upload(uni_id, entry, school_doc_ref)
+                                                   for entry in selected)))
+
+            if stop:
+                break
+            if not has_next:
+                print(f"No more pages to scrape for uni_id {uni_id}.")
+                break
+            page += 1
+
+        if self.checkpoints:
+            self.checkpoints.prune(uni_id, self.cutoff)
+            await asyncio.to_thread(self.checkpoints.save)
+        if self.activity:
+            self.activity.record(uni_id, seen_entries, requests)
+
+    async def stream_school(self, uni_id, prefetch=2):
+        """Async iterator over one school's POST, COMMENT and POST_END records, thread by thread."""
+        seen_entries = []
+        requests = 0
+        page = 1
+        done = False
+        while not done:
+            status, response = await self.fetch(listing_page_url(uni_id, page))
+            requests += 1
+            if response is None:
+                print(f"Failed to retrieve page {page} for uni_id {uni_id}. Status code: {status}")
+                break
+            parsed = await self.pipeline.parse("listing", response)
+            if parsed is None:
+                break
+            entries, has_next = parsed
+            for entry in entries:
+                if not self._in_window(entry):
+                    done = True
+                    break
+                seen_entries.append(entry)
+                if not self.seen.claim(entry["post_url"]):
+                    continue
+                try:
+                    async for record in self.stream_thread(uni_id, entry, prefetch):
+                        if record["kind"] == POST_END:
+                            requests += record["pages"]
+                        yield record
+                except RequestException as e:
+                    # The post's records so far stand; it just ends without a POST_END
+                    print(f"Stopped streaming post '{entry['title']}': {e}")
+            done = done or not has_next
+            page += 1
+        if self.activity:
+            self.activity.record(uni_id, seen_entries, requests)
+
+    async def stream(self, schools, buffer=256, prefetch=2):
+        """Async iterator over SCHOOL and post records for every school.
+
+        `school_concurrency` schools are crawled at once, so records of
+        different posts interleave; each record carries its post_url. At
+        most `buffer` records wait for the consumer before crawling pauses.
+        """
+        await self._start()
+        records = asyncio.Queue(maxsize=buffer)
+        todo = asyncio.Queue()
+        for school in schools:
+            if school.get("uni_id"):
+                todo.put_nowait(school)
+        done = object()
+
+        async def worker():
+            try:
+                while not todo.empty():
+                    school = todo.get_nowait()
+                    await records.put(school_record(school))
+                    try:
+                        async for record in self.stream_school(school["uni_id"], prefetch):
+                            await records.put(record)
+                    except Exception as e:
+                        print(f"Error streaming {school['name']}: {e}")
+            finally:
+                await records.put(done)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.school_concurrency)]
+        try:
+            remaining = len(workers)
+            while remaining:
+                record = await records.get()
+                if record is done:
+                    remaining -= 1
+                else:
+                    yield record
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self._stop()
+
+    async def _school_worker(self, queue, school_doc_ref_for):
+        while True:
+            school = await queue.get()
+            try:
+                print(f"Scraping posts from GreekRank for {school['name']} (uni_id: {school['uni_id']})...")
+                with metrics.span("school", uni_id=school["uni_id"], name=school["name"]):
+                    await self.scrape_school(school["uni_id"], school_doc_ref_for(school))
+                print(f"Finished scraping posts for {school['name']}.\n")
+            except Exception as e:
+                print(f"Error scraping {school['name']}: {e}")
+                metrics.log("school_failed", uni_id=school["uni_id"], name=school["name"], error=str(e))
+            finally:
+                queue.task_done()
+                metrics.gauge("greekrank_queue_depth", queue.qsize(), queue="schools")
+
+    async def run(self, schools, school_doc_ref_for):
+        """Crawl every school; `school_doc_ref_for(school)` gives its Firestore document."""
+        await self._start()
+        queue = asyncio.Queue()
+        for school in schools:
+            if not school.get("uni_id"):
+                print(f"Skipping school '{school['name']}' due to missing uni_id.")
+                continue
+            queue.put_nowait(school)
+
+        workers = [asyncio.create_task(self._school_worker(queue, school_doc_ref_for))
+                   for _ in range(self.school_concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self._stop()
+
+    async def _start(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+        await self.pipeline.start()
+
+    async def _stop(self):
+        await self.pipeline.close()
+        self._executor.shutdown(wait=False)
+        self.client.close()
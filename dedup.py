@@ -0,0 +1,39 @@
+import threading
+
+from parsers import thread_id
+
+# ---------------------- Per-Run Thread Dedup ----------------------
+class SeenThreads:
+    """Thread IDs already taken on in this run.
+
+    Listings shift while we paginate (a bumped thread moves back to page
+    1), so the same thread can turn up on two listing pages; claim() says
+    yes only the first time. IDs come from parsers.thread_id, so a thread
+    re-titled mid-crawl (new slug in its URL) still counts once. `ids`
+    seeds the set, e.g. from a previous snapshot.
+    """
+
+    def __init__(self, ids=()):
+        self._ids = set(ids)
+        self._lock = threading.Lock()
+
+    def claim(self, post_url):
+        key = thread_id(post_url)
+        with self._lock:
+            if key in self._ids:
+                return False
+            self._ids.add(key)
+            return True
+
+    def release(self, post_url):
+        # Give back a claim whose scrape failed, so a retry takes the thread on again
+        with self._lock:
+            self._ids.discard(thread_id(post_url))
+
+    def __contains__(self, post_url):
+        with self._lock:
+            return thread_id(post_url) in self._ids
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
@@ -0,0 +1,116 @@
+import copy
+import threading
+import uuid
+
+# ---------------------- In-Memory Firestore ----------------------
+# Just enough of the google.cloud.firestore surface (collection/document refs,
+# set/get/add and WriteBatch) for the writers, benchmarks and dry runs to work
+# without credentials. Documents live in `client.documents` keyed by path.
+
+class Snapshot:
+    def __init__(self, ref, data):
+        self.reference = ref
+        self.id = ref.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def set(self, data, merge=False):
+        self._client._commit([(self, data, merge)])
+
+    def get(self):
+        with self._client._lock:
+            return Snapshot(self, self._client.documents.get(self.path))
+
+class CollectionReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id=None):
+        return DocumentReference(self._client, f"{self.path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+    def stream(self):
+        prefix = self.path + "/"
+        with self._client._lock:
+            items = [(p, d) for p, d in self._client.documents.items()
+                     if p.startswith(prefix) and "/" not in p[len(prefix):]]
+        return [Snapshot(DocumentReference(self._client, p), d) for p, d in sorted(items)]
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, data, merge))
+
+    def commit(self):
+        self._client._commit(self._writes)
+        return [None] * len(self._writes)
+
+def _merge(target, data):
+    # set(merge=True) merges nested maps field by field, like Firestore does
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+class Client:
+    """In-memory stand-in for firestore.Client.
+
+    `fail_paths` makes any write touching those document paths raise, and
+    `fail_commits` makes the next N commits raise, to exercise retry paths.
+    """
+
+    def __init__(self, fail_paths=(), fail_commits=0):
+        self.documents = {}
+        self.commits = 0
+        self.writes = 0
+        self.fail_paths = set(fail_paths)
+        self.fail_commits = fail_commits
+        self._lock = threading.Lock()
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def document(self, path):
+        return DocumentReference(self, path)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def _commit(self, writes):
+        with self._lock:
+            if self.fail_commits:
+                self.fail_commits -= 1
+                raise RuntimeError("injected commit failure")
+            for ref, _, _ in writes:
+                if ref.path in self.fail_paths:
+                    raise RuntimeError(f"injected write failure for {ref.path}")
+            for ref, data, merge in writes:
+                data = copy.deepcopy(data)
+                if merge and ref.path in self.documents:
+                    _merge(self.documents[ref.path], data)
+                else:
+                    self.documents[ref.path] = data
+            self.commits += 1
+            self.writes += len(writes)
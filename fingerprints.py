@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import threading
+
+DEFAULT_PATH = "write_fingerprints.json"
+
+def fingerprint(value) -> str:
+    # Canonical JSON, so dict order and datetime objects hash the same way every run
+    data = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(data.encode()).hexdigest()[:12]
+
+# ---------------------- Fingerprint Store ----------------------
+class FingerprintStore:
+    """Per-document, per-field content fingerprints of what was last written, persisted as JSON.
+
+    changes() compares a write against them, so BufferedWriter can drop
+    writes that would store identical data and shrink the rest to the
+    fields that actually changed.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self._documents = json.load(f)
+        else:
+            self._documents = {}
+
+    def changes(self, doc_path, data, merge=False):
+        """(fields to write, merge) for a set(), or None when nothing would change.
+
+        A known document written without merge becomes a merge of just the
+        changed fields, unless a field was dropped, which needs the full set.
+        """
+        fields = {key: fingerprint(value) for key, value in data.items()}
+        with self._lock:
+            known = self._documents.get(doc_path)
+            if known is None:
+                return data, merge
+            changed = {key: data[key] for key, value in fields.items() if known.get(key) != value}
+            if not merge and set(known) - set(fields):
+                return data, False
+        if not changed:
+            return None
+        return changed, True
+
+    def record(self, doc_path, data, merge=False):
+        fields = {key: fingerprint(value) for key, value in data.items()}
+        with self._lock:
+            if merge and doc_path in self._documents:
+                self._documents[doc_path].update(fields)
+            else:
+                self._documents[doc_path] = fields
+
+    def forget(self, doc_path):
+        with self._lock:
+            self._documents.pop(doc_path, None)
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self._documents, separators=(",", ":"))
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,215 @@
+import os
+import random
+import threading
+import time
+
+import metrics
+
+MAX_BATCH_WRITES = 500  # Firestore's limit on writes per commit
+
+# ---------------------- Client ----------------------
+_db = None
+_writer = None
+_writer_options = {}
+_db_lock = threading.Lock()
+
+def get_db():
+    """Shared Firestore client, built on first use.
+
+    With FIRESTORE_EMULATOR_HOST set the client talks to the local emulator
+    and needs no service account.
+    """
+    global _db
+    with _db_lock:
+        if _db is None:
+            from google.cloud import firestore
+
+            if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+                _db = firestore.Client(project=os.environ.get("GCLOUD_PROJECT", "greeklink-local"))
+            else:
+                _db = firestore.Client.from_service_account_json("serviceAccountKey.json")
+        return _db
+
+def use_client(client):
+    """Make get_db()/get_writer() use `client`, e.g. a fake_firestore.Client() for benchmarks."""
+    global _db, _writer
+    with _db_lock:
+        previous = _writer
+        _db, _writer = client, None
+    if previous is not None:
+        previous.close()
+
+def configure_writer(**kwargs):
+    """BufferedWriter options for the shared writer, e.g. configure_writer(fingerprints=FingerprintStore())."""
+    global _writer, _writer_options
+    with _db_lock:
+        previous = _writer
+        _writer, _writer_options = None, kwargs
+    if previous is not None:
+        previous.close()
+
+# ---------------------- Buffered Writer ----------------------
+class BufferedWriter:
+    """Group document writes into WriteBatch commits on a background thread.
+
+    Writes are buffered and committed once `max_batch` are queued or
+    `flush_interval` seconds have passed, so scraping keeps going while
+    Firestore round trips happen. A batch that keeps failing is split into
+    single-document writes so one bad document can't sink its neighbours;
+    documents that still fail after `max_retries` land in `failures`.
+    `max_pending` bounds the buffer: set() blocks when the writer falls behind.
+
+    With a FingerprintStore, writes that would store identical data are
+    skipped and the rest only send the fields that changed.
+    """
+
+    def __init__(self, client, max_batch=MAX_BATCH_WRITES, flush_interval=1.0, max_retries=3,
+                 backoff_base=0.5, max_pending=5 * MAX_BATCH_WRITES, fingerprints=None):
+        if not 0 < max_batch <= MAX_BATCH_WRITES:
+            raise ValueError(f"max_batch must be between 1 and {MAX_BATCH_WRITES}")
+        self.client = client
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_pending = max(max_pending, max_batch)
+        self.fingerprints = fingerprints
+
+        self.written = 0
+        self.skipped = 0
+        self.failures = []  # (document path, error message)
+
+        self._pending = []
+        self._queued = 0       # writes accepted so far
+        self._done = 0         # writes committed or given up on
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="firestore-writer", daemon=True)
+        self._thread.start()
+
+    def set(self, doc_ref, data, merge=False):
+        if self.fingerprints is not None:
+            changes = self.fingerprints.changes(doc_ref.path, data, merge)
+            if changes is None:
+                with self._cond:
+                    self.skipped += 1
+                metrics.inc("greekrank_firestore_writes_total", result="skipped")
+                return
+            self.fingerprints.record(doc_ref.path, data, merge)
+            data, merge = changes
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BufferedWriter is closed")
+            while len(self._pending) >= self.max_pending:
+                self._cond.wait()
+            self._pending.append((doc_ref, data, merge))
+            self._queued += 1
+            metrics.gauge("greekrank_queue_depth", len(self._pending), queue="firestore")
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+
+    def flush(self):
+        """Block until every write queued before this call has been committed or failed."""
+        with self._cond:
+            target = self._queued
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._done < target:
+                self._cond.wait()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def summary(self) -> dict:
+        with self._cond:
+            return {"written": self.written, "skipped": self.skipped, "failed": len(self.failures),
+                    "pending": len(self._pending)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (len(self._pending) < self.max_batch and not self._flush_requested
+                       and not self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed and not self._pending:
+                    return
+                ops = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                if not self._pending:
+                    self._flush_requested = False
+                self._cond.notify_all()
+
+            if ops:
+                self._commit(ops)
+                with self._cond:
+                    self._done += len(ops)
+                    self._cond.notify_all()
+
+    def _retry(self, action):
+        for attempt in range(self.max_retries + 1):
+            try:
+                action()
+                return None
+            except Exception as e:
+                error = e
+                if attempt < self.max_retries:
+                    time.sleep(random.uniform(0, self.backoff_base * 2 ** attempt))
+        return error
+
+    def _commit(self, ops):
+        def commit_batch():
+            batch = self.client.batch()
+            for doc_ref, data, merge in ops:
+                batch.set(doc_ref, data, merge=merge)
+            batch.commit()
+
+        started = time.perf_counter()
+        error = self._retry(commit_batch)
+        metrics.observe("greekrank_firestore_commit_seconds", time.perf_counter() - started)
+        if error is None:
+            with self._cond:
+                self.written += len(ops)
+                metrics.gauge("greekrank_queue_depth", len(self._pending), queue="firestore")
+            metrics.inc("greekrank_firestore_writes_total", len(ops), result="written")
+            return
+
+        # Batches are atomic, so fall back to one write per document to isolate the bad ones
+        print(f"Batch of {len(ops)} writes failed ({error}); retrying documents individually.")
+        for doc_ref, data, merge in ops:
+            error = self._retry(lambda: doc_ref.set(data, merge=merge))
+            with self._cond:
+                if error is None:
+                    self.written += 1
+                else:
+                    self.failures.append((doc_ref.path, str(error)))
+            metrics.inc("greekrank_firestore_writes_total", result="written" if error is None else "failed")
+            if error is not None:
+                metrics.log("firestore_write_failed", path=doc_ref.path, error=str(error))
+                if self.fingerprints is not None:
+                    # Nothing was stored, so the next run must send it again
+                    self.fingerprints.forget(doc_ref.path)
+                print(f"Error writing {doc_ref.path}: {error}")
+
+def get_writer() -> BufferedWriter:
+    """Shared BufferedWriter on the default client; close it before exiting."""
+    global _writer
+    client = get_db()
+    with _db_lock:
+        if _writer is None:
+            _writer = BufferedWriter(client, **_writer_options)
+        return _writer
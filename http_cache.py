@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import zlib
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import metrics
+
+DEFAULT_CACHE_DIR = ".http_cache"
+CACHEABLE_STATUSES = {200, 404}
+MISSING = object()
+PARSED_VERSION = 3  # bump when parser output changes shape, so stale .parsed files are ignored
+
+# Headers worth keeping with a cached body
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Date")
+
+class CacheMiss(requests.RequestException):
+    """Raised in offline mode for URLs that were never cached."""
+
+# ---------------------- On-Disk Cache ----------------------
+class HttpCache:
+    """URL-keyed on-disk cache of compressed response bodies.
+
+    Each URL hashes to `{dir}/{xx}/{sha256}` with a `.meta` JSON file
+    (status, headers, fetch time) and a zlib-compressed `.body`. Parsed
+    results can be stored alongside (`.{kind}.v{N}.parsed`) so a 304 skips the
+    reparse as well as the download; they are dropped whenever the body
+    changes. Entries younger than `ttl` seconds are served without asking
+    the server, older ones are revalidated with If-None-Match /
+    If-Modified-Since. The directory is kept under `max_bytes` by evicting
+    least recently used entries. `offline=True` replays the cache only and
+    never touches the network.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, ttl=3600, max_bytes=512 * 1024 * 1024, offline=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(os.path.getsize(os.path.join(root, name)) for root, name in self._files())
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".tmp"):
+                    yield root, name
+
+    def _base(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += len(data) - old_size
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def lookup(self, url):
+        """Cached (meta, body) for url, or None."""
+        base = self._base(url)
+        try:
+            with open(base + ".meta") as f:
+                meta = json.load(f)
+            with open(base + ".body", "rb") as f:
+                body = zlib.decompress(f.read())
+        except (FileNotFoundError, ValueError, zlib.error):
+            return None
+        # Touch the body so LRU eviction sees the access
+        os.utime(base + ".body")
+        return meta, body
+
+    def is_fresh(self, meta):
+        return time.time() - meta["fetched_at"] < self.ttl
+
+    def store(self, url, response):
+        base = self._base(url)
+        meta = {
+            "url": url,
+            "status": response.status_code,
+            "encoding": response.encoding,
+            "headers": {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+            "fetched_at": time.time(),
+        }
+        for path in self._parsed_files(base):
+            self._remove(path)
+        self._write(base + ".body", zlib.compress(response.content))
+        self._write(base + ".meta", json.dumps(meta).encode())
+        self._evict()
+
+    def touch(self, url, meta):
+        # A 304 confirms the cached body; restart its TTL
+        meta["fetched_at"] = time.time()
+        self._write(self._base(url) + ".meta", json.dumps(meta).encode())
+
+    def _parsed_files(self, base):
+        directory, prefix = os.path.split(base)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, name) for name in os.listdir(directory)
+                if name.startswith(prefix) and name.endswith(".parsed")]
+
+    def load_parsed(self, url, kind):
+        try:
+            with open(f"{self._base(url)}.{kind}.v{PARSED_VERSION}.parsed", "rb") as f:
+                return pickle.loads(zlib.decompress(f.read()))
+        except (FileNotFoundError, pickle.UnpicklingError, zlib.error, EOFError):
+            return MISSING
+
+    def store_parsed(self, url, kind, result):
+        self._write(f"{self._base(url)}.{kind}.v{PARSED_VERSION}.parsed", zlib.compress(pickle.dumps(result)))
+
+    def _evict(self):
+        with self._lock:
+            if self._size <= self.max_bytes:
+                return
+        # Group files by entry and drop the least recently read entries first
+        entries = {}
+        for root, name in self._files():
+            base = os.path.join(root, name.split(".", 1)[0])
+            entries.setdefault(base, []).append(os.path.join(root, name))
+
+        def last_used(base):
+            try:
+                return os.path.getmtime(base + ".body")
+            except FileNotFoundError:
+                return 0
+
+        target = self.max_bytes * 0.9
+        for base in sorted(entries, key=last_used):
+            with self._lock:
+                if self._size <= target:
+                    break
+            for path in entries[base]:
+                self._remove(path)
+
+    def response(self, url, meta, body, not_modified):
+        """Rebuild a requests.Response from a cache entry."""
+        response = requests.Response()
+        response.status_code = meta["status"]
+        response.url = url
+        response.encoding = meta["encoding"]
+        response.headers = CaseInsensitiveDict(meta["headers"])
+        response._content = body
+        response.from_cache = True
+        response.not_modified = not_modified
+        response.cache = self
+        response.cache_url = url
+        return response
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses,
+                    "bytes": self._size}
+
+def conditional_headers(meta):
+    headers = {}
+    if meta["headers"].get("ETag"):
+        headers["If-None-Match"] = meta["headers"]["ETag"]
+    if meta["headers"].get("Last-Modified"):
+        headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+    return headers
+
+def parse_cached(response, kind, parse, *args):
+    """Run `parse(response.text, *args)`, reusing the cached result when the page was not modified."""
+    cache = getattr(response, "cache", None)
+    if cache is None:
+        with metrics.timed("greekrank_parse_seconds", kind=kind):
+            return parse(response.text, *args)
+    if response.not_modified:
+        result = cache.load_parsed(response.cache_url, kind)
+        if result is not MISSING:
+            return result
+    with metrics.timed("greekrank_parse_seconds", kind=kind):
+        result = parse(response.text, *args)
+    cache.store_parsed(response.cache_url, kind, result)
+    return result
@@ -0,0 +1,226 @@
+import random
+import threading
+import time
+import requests
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+from http_cache import CACHEABLE_STATUSES, CacheMiss, conditional_headers
+import metrics
+from rate_limit import polite_limiter
+
+DEFAULT_TIMEOUT = (5, 30)  # (connect, read) seconds
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_HEADERS = {
+    "User-Agent": "greeklinkscraper/1.0 (+https://github.com/rkaelle/greeklinkscraper)",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+first_request_at = None  # perf_counter() of the process's first request, for startup timing
+
+class FetchError(requests.RequestException):
+    """Raised once a URL keeps failing after every retry."""
+
+# ---------------------- Latency Stats ----------------------
+class FetchStats:
+    """Per-request latency (including retries) for the last `window` fetches."""
+
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, attempts, failed=False):
+        with self._lock:
+            self.latencies.append(latency)
+            self.requests += 1
+            self.retries += attempts - 1
+            self.failures += failed
+
+    def summary(self) -> dict:
+        with self._lock:
+            ordered = sorted(self.latencies)
+            requests_, retries, failures = self.requests, self.retries, self.failures
+        if not ordered:
+            return {"requests": requests_, "retries": retries, "failures": failures}
+
+        def pct(p):
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+        return {
+            "requests": requests_,
+            "retries": retries,
+            "failures": failures,
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+            "max": ordered[-1],
+        }
+
+# ---------------------- Pooled Client ----------------------
+def retry_after_seconds(response):
+    # Retry-After is either a number of seconds or an HTTP date
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class HttpClient:
+    """One pooled keep-alive session with retries, backoff and latency stats.
+
+    Transient failures (connection errors, timeouts, 429 and 5xx) are retried
+    with exponential backoff and full jitter, honoring Retry-After on 429/503.
+    A limiter with a release() method hears about every attempt, so an
+    AdaptiveRateLimiter can slow down or speed up.
+    When retries run out a FetchError is raised so callers never mistake a
+    flaky page for the end of pagination. Other statuses (e.g. 404) are
+    returned as-is.
+
+    With an HttpCache, fresh entries are served from disk, stale ones are
+    revalidated with a conditional GET, and responses carry `cache` and
+    `not_modified` so callers can reuse cached parse results
+    (see http_cache.parse_cached).
+    """
+
+    def __init__(self, pool_size=16, timeout=DEFAULT_TIMEOUT, max_retries=4, backoff_base=0.5,
+                 backoff_max=30.0, limiter=polite_limiter, headers=None, cache=None):
+        self.timeout = timeout
+        self.cache = cache
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = limiter
+        self.stats = FetchStats()
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        if headers:
+            self.session.headers.update(headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt, response=None):
+        if response is not None and response.status_code in (429, 503):
+            retry_after = retry_after_seconds(response)
+            if retry_after is not None:
+                return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def get(self, url, **kwargs):
+        if self.cache is None:
+            return self._get(url, **kwargs)
+
+        cached = self.cache.lookup(url)
+        if cached is None:
+            if self.cache.offline:
+                raise CacheMiss(f"{url} is not in the offline cache")
+            self.cache.misses += 1
+            metrics.inc("greekrank_cache_total", result="miss")
+            response = self._get(url, **kwargs)
+        else:
+            meta, body = cached
+            if self.cache.offline or self.cache.is_fresh(meta):
+                self.cache.hits += 1
+                metrics.inc("greekrank_cache_total", result="hit")
+                return self.cache.response(url, meta, body, not_modified=True)
+            headers = {**conditional_headers(meta), **kwargs.pop("headers", {})}
+            response = self._get(url, headers=headers, **kwargs)
+            if response.status_code == 304:
+                self.cache.revalidated += 1
+                metrics.inc("greekrank_cache_total", result="revalidated")
+                self.cache.touch(url, meta)
+                return self.cache.response(url, meta, body, not_modified=True)
+
+        if response.status_code in CACHEABLE_STATUSES:
+            self.cache.store(url, response)
+        response.cache = self.cache
+        response.cache_url = url
+        response.not_modified = False
+        return response
+
+    def _get(self, url, **kwargs):
+        global first_request_at
+        if first_request_at is None:
+            first_request_at = time.perf_counter()
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.perf_counter()
+        attempt = 0
+        # Adaptive limiters (rate_limit.AdaptiveRateLimiter) learn from how each attempt went
+        release = getattr(self.limiter, "release", None)
+        while True:
+            if self.limiter:
+                self.limiter.acquire(url)
+            response = None
+            attempt_started = time.perf_counter()
+            try:
+                response = self.session.get(url, **kwargs)
+                metrics.inc("greekrank_requests_total", status=response.status_code)
+                metrics.inc("greekrank_response_bytes_total", len(response.content))
+                error = None
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                error = f"HTTP {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.inc("greekrank_requests_total", status=type(e).__name__)
+                error = str(e)
+            finally:
+                if release:
+                    release(url, time.perf_counter() - attempt_started,
+                            response.status_code if response is not None else None)
+
+            if attempt >= self.max_retries:
+                self.stats.record(time.perf_counter() - started, attempt + 1, failed=True)
+                metrics.observe("greekrank_fetch_seconds", time.perf_counter() - started)
+                metrics.log("fetch_failed", url=url, attempts=attempt + 1, error=error)
+                raise FetchError(f"Giving up on {url} after {attempt + 1} attempts: {error}",
+                                 response=response)
+            metrics.inc("greekrank_retries_total")
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+        response.latency = time.perf_counter() - started
+        self.stats.record(response.latency, attempt + 1)
+        metrics.observe("greekrank_fetch_seconds", response.latency)
+        return response
+
+    def close(self):
+        self.session.close()
+
+_default_client = None
+_default_lock = threading.Lock()
+
+def configure(**kwargs) -> HttpClient:
+    """Replace the shared client, e.g. configure(cache=HttpCache(...))."""
+    global _default_client
+    with _default_lock:
+        if _default_client is not None:
+            _default_client.close()
+        _default_client = HttpClient(**kwargs)
+        return _default_client
+
+def get_client() -> HttpClient:
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
+
+def fetch(url, **kwargs):
+    """GET through the shared pooled client."""
+    return get_client().get(url, **kwargs)
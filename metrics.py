@@ -0,0 +1,225 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "greekrank_requests_total": "HTTP responses by status code (per attempt).",
+    "greekrank_retries_total": "HTTP attempts that were retried.",
+    "greekrank_response_bytes_total": "Response body bytes downloaded.",
+    "greekrank_fetch_seconds": "Time per fetch, retries included.",
+    "greekrank_cache_total": "HTTP cache lookups by result.",
+    "greekrank_parse_seconds": "Time to parse one page.",
+    "greekrank_queue_depth": "Items waiting in a pipeline queue.",
+    "greekrank_firestore_commit_seconds": "Time per Firestore batch commit.",
+    "greekrank_firestore_writes_total": "Firestore document writes by result.",
+    "greekrank_stage_seconds": "Time spent per crawl stage.",
+    "greekrank_posts_total": "Posts handed to the writer.",
+}
+
+# ---------------------- Registry ----------------------
+# Everything is a no-op until configure() turns it on; call sites only pay for a global lookup.
+_metrics_on = False
+_log_file = None
+_trace_file = None
+_textfile = None
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_gauges = {}      # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    if not _metrics_on:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def gauge(name, value, **labels):
+    if not _metrics_on:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, seconds, **labels):
+    if not _metrics_on:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+@contextlib.contextmanager
+def _timer(name, labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+def timed(name, **labels):
+    """Context manager observing the block's duration into histogram `name`."""
+    if not _metrics_on:
+        return contextlib.nullcontext()
+    return _timer(name, labels)
+
+# ---------------------- Structured Logs & Spans ----------------------
+def _emit(f, record):
+    line = json.dumps(record, default=str) + "\n"
+    with _lock:
+        f.write(line)
+        f.flush()
+
+def log(event, **fields):
+    """One JSON line in the --json-log file, tagged with the current trace/span when tracing."""
+    if _log_file is None:
+        return
+    span = _current_span.get()
+    record = {"ts": time.time(), "event": event, **fields}
+    if span:
+        record.update(trace_id=span[0], span_id=span[1])
+    _emit(_log_file, record)
+
+_current_span = contextvars.ContextVar("greekrank_span", default=None)
+
+@contextlib.contextmanager
+def _span(name, attrs):
+    parent = _current_span.get()
+    trace_id = parent[0] if parent else uuid.uuid4().hex
+    span_id = uuid.uuid4().hex[:16]
+    token = _current_span.set((trace_id, span_id))
+    started = time.time()
+    perf = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        duration = time.perf_counter() - perf
+        observe("greekrank_stage_seconds", duration, stage=name)
+        if _trace_file is not None:
+            _emit(_trace_file, {"name": name, "trace_id": trace_id, "span_id": span_id,
+                                "parent_id": parent[1] if parent else None, "start": started,
+                                "duration": duration, "error": error, "attributes": attrs})
+
+def span(name, /, **attrs):
+    """Trace a block (e.g. one school or one post); spans nest through threads' and tasks' contexts."""
+    if _trace_file is None and not _metrics_on:
+        return contextlib.nullcontext()
+    return _span(name, attrs)
+
+# ---------------------- Exposition ----------------------
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+def render() -> str:
+    """Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            if name in HELP:
+                lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, "gauge")
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        header(name, "histogram")
+        for bound, count in zip(BUCKETS, histogram):
+            lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram[-2]}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram[-1]}")
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path):
+    # Atomic, so a node_exporter textfile collector never reads half a file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+def serve(port, host="0.0.0.0"):
+    """Serve render() at /metrics on a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+def configure(metrics=False, json_log=None, trace=None, textfile=None, textfile_interval=15.0, port=None):
+    """Turn instrumentation on. With nothing passed everything stays a no-op.
+
+    `textfile` is rewritten every `textfile_interval` seconds and by close();
+    `port` serves /metrics.
+    """
+    global _metrics_on, _log_file, _trace_file, _textfile
+    _metrics_on = bool(metrics or textfile or port)
+    _textfile = textfile
+    _log_file = open(json_log, "a") if json_log else None
+    _trace_file = open(trace, "a") if trace else None
+    if port:
+        serve(port)
+    if textfile:
+        def refresh():
+            while True:
+                time.sleep(textfile_interval)
+                write_textfile(textfile)
+
+        threading.Thread(target=refresh, name="metrics-textfile", daemon=True).start()
+
+def close():
+    """Write the textfile one last time and close the log and trace files."""
+    global _log_file, _trace_file
+    if _textfile:
+        write_textfile(_textfile)
+    for f in (_log_file, _trace_file):
+        if f is not None:
+            f.close()
+    _log_file = _trace_file = None
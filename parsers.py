@@ -0,0 +1,325 @@
+import hashlib
+import os
+import re
+from datetime import datetime, timezone
+
+from records import ANONYMOUS, NO_CONTENT, UNTITLED, Comment, Post, intern_author, to_timestamp
+
+BASE_URL = "https://www.greekrank.com"
+
+# Every CSS selector the scrapers use, compiled once per backend
+SELECTORS = {
+    "school_links": 'div.inner-container.clearfix.discussions-section div[style*="padding:10px"] a[style*="font-weight:600;"]',
+    "pagination_links": ".post-pagination-list li a",
+    "pagination_items": ".post-pagination-list li",
+    "main_post": ".latest-discussion > .discussion-box.clearfix",
+    "paragraphs": ".discussion-box-content p",
+    "reply_boxes": ".discussion-box-reply .discussion-box.clearfix",
+    "posted_time": ".posted-date time",
+    "comment_author": ".comment",
+    "reply_author": ".discussion-box-head span span",
+    "discussion_boxes": ".discussion-box.clearfix",
+    "title_link": "h5.discussion-box-head a",
+    "like_box": "ul.like-box",
+    "upvotes": "li.like span",
+    "downvotes": "li.unlike span",
+}
+
+# ---------------------- Parser Backends ----------------------
+class LxmlBackend:
+    """lxml.html tree with cssselect selectors compiled to XPath up front."""
+
+    name = "lxml"
+
+    def __init__(self):
+        import lxml.html
+        from lxml.cssselect import CSSSelector
+
+        self._html = lxml.html
+        self.selectors = {key: CSSSelector(css) for key, css in SELECTORS.items()}
+
+    def parse(self, html):
+        try:
+            return self._html.document_fromstring(html)
+        except self._html.etree.ParserError:
+            # Empty documents; BeautifulSoup just returns an empty tree here
+            return self._html.document_fromstring("<html></html>")
+
+    def select(self, node, key):
+        # CSSSelector matches descendant-or-self; soup.select only looks at descendants
+        return [el for el in self.selectors[key](node) if el is not node]
+
+    def select_one(self, node, key):
+        matches = self.select(node, key)
+        return matches[0] if matches else None
+
+    def text(self, node, strip=False):
+        if strip:
+            return "".join(part.strip() for part in node.itertext())
+        return "".join(node.itertext())
+
+    def attr(self, node, name):
+        return node.get(name)
+
+    def find_all(self, node, tag):
+        return [el for el in node.iter(tag) if el is not node]
+
+class SoupBackend:
+    """BeautifulSoup's html.parser, the original pure-Python path, with soupsieve-compiled selectors."""
+
+    name = "bs4"
+
+    def __init__(self):
+        import soupsieve
+        from bs4 import BeautifulSoup
+
+        self._soup = BeautifulSoup
+        self.selectors = {key: soupsieve.compile(css) for key, css in SELECTORS.items()}
+
+    def parse(self, html):
+        return self._soup(html, "html.parser")
+
+    def select(self, node, key):
+        return self.selectors[key].select(node)
+
+    def select_one(self, node, key):
+        return self.selectors[key].select_one(node)
+
+    def text(self, node, strip=False):
+        return node.get_text(strip=strip)
+
+    def attr(self, node, name):
+        return node.get(name)
+
+    def find_all(self, node, tag):
+        return node.find_all(tag)
+
+BACKENDS = {"lxml": LxmlBackend, "bs4": SoupBackend}
+_backend = None
+
+def set_backend(name):
+    """Switch the parser backend ("lxml" or "bs4") for every parse_* function."""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown parser backend {name!r}; expected one of {sorted(BACKENDS)}")
+    _backend = BACKENDS[name]()
+    return _backend
+
+def get_backend():
+    # GREEKRANK_PARSER picks a backend explicitly; otherwise prefer lxml when it's installed
+    if _backend is None:
+        name = os.environ.get("GREEKRANK_PARSER")
+        if name:
+            return set_backend(name)
+        try:
+            set_backend("lxml")
+        except ImportError:
+            set_backend("bs4")
+    return _backend
+
+# ---------------------- Field Helpers ----------------------
+def parse_post_date(datetime_str):
+    try:
+        # Parse the datetime string and make it timezone-aware (UTC)
+        return datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+def clean_author(author_text):
+    if not author_text:
+        return ANONYMOUS
+    author = re.sub(r"^by:\s*", "", author_text, flags=re.IGNORECASE)
+    return intern_author(author.strip()) if author else ANONYMOUS
+
+def _author(backend, node, *keys):
+    for key in keys:
+        author_tag = backend.select_one(node, key)
+        if author_tag is not None:
+            return clean_author(backend.text(author_tag, strip=True))
+    return ANONYMOUS
+
+def _date(backend, node):
+    time_tag = backend.select_one(node, "posted_time")
+    datetime_str = backend.attr(time_tag, "datetime") if time_tag is not None else None
+    return parse_post_date(datetime_str) if datetime_str is not None else None
+
+def _paragraphs(backend, node):
+    paragraphs = backend.select(node, "paragraphs")
+    if not paragraphs:
+        return NO_CONTENT
+    return "\n\n".join(backend.text(p) for p in paragraphs).strip()
+
+def has_next_page(backend, root):
+    # GreekRank paginates with a "NEXT >" link inside .post-pagination-list
+    for link in backend.select(root, "pagination_links"):
+        if "NEXT" in backend.text(link, strip=True).upper():
+            return True
+    return False
+
+def last_page_number(backend, root):
+    """Highest page the pagination list links to, or None when that can't be told.
+
+    A truncated list ("1 2 3 ... NEXT >") without a LAST link doesn't say how
+    many pages there are, so callers fall back to following NEXT links.
+    """
+    for item in backend.select(root, "pagination_items"):
+        if backend.text(item, strip=True) in ("...", "\u2026"):
+            return None
+
+    numbers = {1}
+    for link in backend.select(root, "pagination_links"):
+        text = backend.text(link, strip=True)
+        href_match = re.search(r"page-(\d+)/?$", backend.attr(link, "href") or "")
+        if "LAST" in text.upper() and href_match:
+            return int(href_match.group(1))
+        if text.isdigit():
+            numbers.add(int(text))
+        elif href_match:
+            numbers.add(int(href_match.group(1)))
+
+    last = max(numbers)
+    # Only trust the count when every page from 1 to last is listed
+    return last if numbers == set(range(1, last + 1)) else None
+
+def listing_page_url(uni_id, page):
+    base_url = f"{BASE_URL}/uni/{uni_id}/discussion/"
+    return base_url if page == 1 else f"{base_url}page-{page}/"
+
+def thread_page_url(post_url, page):
+    base_post_url = post_url[:-1] if post_url.endswith('/') else post_url
+    return base_post_url + '/' if page == 1 else base_post_url + f'/page-{page}/'
+
+def thread_id(post_url):
+    """Stable ID for a thread: the number in /uni/{uni}/discussion/{id}/{slug}/.
+
+    Titles change and repeat, the thread number doesn't. URLs without one
+    fall back to a hash of the path.
+    """
+    match = re.search(r"/discussion/(\d+)(?:/|$)", post_url)
+    if match:
+        return match.group(1)
+    path = re.sub(r"^https?://[^/]+", "", post_url).rstrip("/")
+    return "u" + hashlib.sha1(path.encode()).hexdigest()[:16]
+
+# ---------------------- Page Parsers ----------------------
+def parse_school_list(html):
+    """Parse the /list/ page into (school name, href) pairs."""
+    backend = get_backend()
+    root = backend.parse(html)
+    return [(backend.text(link, strip=True), backend.attr(link, "href") or "")
+            for link in backend.select(root, "school_links")]
+
+def parse_thread_page(html, first_page=False):
+    """Parse one page of a thread into (main_post_content, comments, has_next, last_page).
+
+    main_post_content is only looked up on the first page and stays None when
+    the main post box is missing. last_page is the thread's page count as far
+    as the pagination list tells (see last_page_number).
+    """
+    backend = get_backend()
+    root = backend.parse(html)
+    main_post_content = None
+
+    if first_page:
+        main_post_box = backend.select_one(root, "main_post")
+        if main_post_box is not None:
+            main_post_content = _paragraphs(backend, main_post_box)
+
+    comments = []
+    for reply in backend.select(root, "reply_boxes"):
+        comments.append(Comment(_author(backend, reply, "comment_author", "reply_author"),
+                                to_timestamp(_date(backend, reply)), _paragraphs(backend, reply)))
+
+    has_next = has_next_page(backend, root)
+    last_page = last_page_number(backend, root) if has_next else None
+    return main_post_content, comments, has_next, last_page
+
+def assemble_thread(pages):
+    """Join parsed thread pages, in page order, up to the first missing (None) page.
+
+    Returns (main_post_content, comments, pages_read, last_page_comments).
+    """
+    main_post_content = pages[0][0] if pages and pages[0] is not None else None
+    comments = []
+    last_page_comments = 0
+    pages_read = 0
+    for page in pages:
+        if page is None:
+            break
+        comments.extend(page[1])
+        last_page_comments = len(page[1])
+        pages_read += 1
+    return main_post_content, comments, pages_read, last_page_comments
+
+def _int_text(backend, node, key):
+    tag = backend.select_one(node, key)
+    return int(backend.text(tag, strip=True)) if tag is not None else 0
+
+def _like_box_counts(backend, like_box):
+    # One pass over the <li>s picks up both the 'Views' and the reply count entries
+    views = replies = None
+    for li in backend.find_all(like_box, "li"):
+        li_text = backend.text(li)
+        if views is None and "Views" in li_text:
+            views_match = re.search(r"(\d+)", backend.text(li, strip=True))
+            views = int(views_match.group(1)) if views_match else 0
+        if replies is None and re.search(r"Repl|Comment", li_text):
+            # Reply count, when the listing shows one; used by incremental crawls
+            replies_match = re.search(r"(\d+)", backend.text(li, strip=True))
+            replies = int(replies_match.group(1)) if replies_match else None
+        if views is not None and replies is not None:
+            break
+    return views or 0, replies
+
+def parse_listing_page(html):
+    """Parse a /uni/{id}/discussion/ listing page into (entries, has_next).
+
+    Returns None instead of a tuple when the page has no discussion boxes.
+    """
+    backend = get_backend()
+    root = backend.parse(html)
+    discussion_boxes = backend.select(root, "discussion_boxes")
+    if not discussion_boxes:
+        return None
+
+    entries = []
+    for post_element in discussion_boxes:
+        title_tag = backend.select_one(post_element, "title_link")
+        title = backend.text(title_tag, strip=True) if title_tag is not None else UNTITLED
+        post_url = backend.attr(title_tag, "href") if title_tag is not None else None
+        if post_url and post_url.startswith("/"):
+            post_url = BASE_URL + post_url
+
+        # Snippet is the first paragraph only
+        content_tag = backend.select_one(post_element, "paragraphs")
+        snippet_content = backend.text(content_tag).strip() if content_tag is not None else NO_CONTENT
+
+        # Extract upvotes, downvotes, views from the HTML structure
+        like_box = backend.select_one(post_element, "like_box")
+        if like_box is not None:
+            upvotes = _int_text(backend, like_box, "upvotes")
+            downvotes = _int_text(backend, like_box, "downvotes")
+            views, replies = _like_box_counts(backend, like_box)
+        else:
+            # Fallback if like-box isn't found (shouldn't happen typically)
+            upvotes = downvotes = views = 0
+            replies = None
+
+        entries.append({
+            "title": title,
+            "post_url": post_url,
+            "snippet": snippet_content,
+            "author": _author(backend, post_element, "comment_author"),
+            "date": _date(backend, post_element),
+            "views": views,
+            "upvotes": upvotes,
+            "downvotes": downvotes,
+            "replies": replies
+        })
+
+    return entries, has_next_page(backend, root)
+
+def build_post(entry, full_content, comments):
+    # Assemble a Post from a listing entry and its thread details; sinks turn it into the Firestore dict
+    return Post(entry["title"], entry["post_url"], full_content or entry["snippet"], entry["author"],
+                to_timestamp(entry["date"]), comments, entry["views"], entry["upvotes"], entry["downvotes"])
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from http_cache import MISSING
+import metrics
+from parsers import parse_listing_page, parse_thread_page
+
+# ---------------------- Parse Workers ----------------------
+def decode_page(content, encoding):
+    return content.decode(encoding or "utf-8", errors="replace")
+
+def parse_page(kind, content, encoding, first_page=False):
+    """Decode and parse one raw page; runs inside a worker process."""
+    html = decode_page(content, encoding)
+    if kind == "listing":
+        return parse_listing_page(html)
+    if kind == "thread":
+        return parse_thread_page(html, first_page=first_page)
+    raise ValueError(f"Unknown page kind {kind!r}")
+
+# ---------------------- Staged Pipeline ----------------------
+class ParsePipeline:
+    """Fetch -> parse -> write stages joined by bounded queues.
+
+    Fetchers hand raw page bytes to parse(), which queues them for a
+    ProcessPoolExecutor so BeautifulSoup/lxml work never holds the event
+    loop's GIL. Finished records go through emit() to a writer stage that
+    runs the (blocking) sink on a thread. Both queues are bounded: when
+    parsing or writing falls behind, fetchers and producers wait instead of
+    piling pages up in memory.
+
+    workers=0 parses inline on the event loop, which is handy for debugging.
+    """
+
+    def __init__(self, workers=None, page_queue_size=64, record_queue_size=256, writer_workers=1):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.pages = asyncio.Queue(maxsize=page_queue_size)
+        self.records = asyncio.Queue(maxsize=record_queue_size)
+        self.writer_workers = writer_workers
+        self._pool = None
+        self._tasks = []
+
+    async def start(self):
+        if self.workers:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._tasks = [asyncio.create_task(self._parse_worker()) for _ in range(max(self.workers, 1))]
+        self._tasks += [asyncio.create_task(self._write_worker()) for _ in range(self.writer_workers)]
+
+    async def parse(self, kind, response, first_page=False):
+        """Parse a fetched page, reusing the HttpCache's parse result when the page was not modified."""
+        cache = getattr(response, "cache", None)
+        cache_kind = f"{kind}-1" if first_page else kind
+        if cache is not None and response.not_modified:
+            result = await asyncio.to_thread(cache.load_parsed, response.cache_url, cache_kind)
+            if result is not MISSING:
+                return result
+
+        future = asyncio.get_running_loop().create_future()
+        await self.pages.put((kind, response.content, response.encoding, first_page, future))
+        metrics.gauge("greekrank_queue_depth", self.pages.qsize(), queue="pages")
+        result = await future
+        if cache is not None:
+            await asyncio.to_thread(cache.store_parsed, response.cache_url, cache_kind, result)
+        return result
+
+    async def emit(self, sink, *args):
+        """Queue `sink(*args)` for the writer stage."""
+        await self.records.put((sink, args))
+        metrics.gauge("greekrank_queue_depth", self.records.qsize(), queue="records")
+
+    async def _parse_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            kind, content, encoding, first_page, future = await self.pages.get()
+            metrics.gauge("greekrank_queue_depth", self.pages.qsize(), queue="pages")
+            try:
+                # Timed here: the worker processes have registries of their own
+                started = time.perf_counter()
+                if self._pool:
+                    result = await loop.run_in_executor(self._pool, parse_page, kind, content, encoding, first_page)
+                else:
+                    result = parse_page(kind, content, encoding, first_page)
+                metrics.observe("greekrank_parse_seconds", time.perf_counter() - started, kind=kind)
+                if not future.cancelled():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+            finally:
+                self.pages.task_done()
+
+    async def _write_worker(self):
+        while True:
+            sink, args = await self.records.get()
+            metrics.gauge("greekrank_queue_depth", self.records.qsize(), queue="records")
+            try:
+                await asyncio.to_thread(sink, *args)
+            except Exception as e:
+                print(f"Error in {getattr(sink, '__name__', sink)}: {e}")
+            finally:
+                self.records.task_done()
+
+    def depths(self) -> dict:
+        return {"pages": self.pages.qsize(), "records": self.records.qsize()}
+
+    async def close(self):
+        # Drain both stages before tearing the workers down
+        await self.pages.join()
+        await self.records.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool:
+            self._pool.shutdown()
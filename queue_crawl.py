@@ -0,0 +1,249 @@
+import argparse
+import os
+import pickle
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from checkpoints import DEFAULT_PATH as DEFAULT_CHECKPOINTS, CheckpointStore, last_comment_date
+import comment_store
+from fingerprints import DEFAULT_PATH as DEFAULT_FINGERPRINTS, FingerprintStore
+from firestore_writer import configure_writer, get_writer
+from http_cache import parse_cached
+from http_client import fetch
+import metrics
+from parsers import assemble_thread, build_post, listing_page_url, parse_listing_page, thread_id
+from scrape import (fetch_thread_page, save_comment_log, thread_is_unchanged, update_post_counters,
+                    upload_single_post_to_firestore)
+from work_queue import DEFAULT_PATH, WorkQueue
+
+UPLOAD_BATCH = 100  # upload tasks are marked done once this many are flushed to Firestore
+
+def entry_to_payload(entry):
+    return {**entry, "date": entry["date"].isoformat() if entry["date"] else None}
+
+def entry_from_payload(payload):
+    return {**payload, "date": datetime.fromisoformat(payload["date"]) if payload["date"] else None}
+
+# ---------------------- Task Handlers ----------------------
+class QueueCrawl:
+    """The school -> listing page -> thread page -> upload crawl as durable tasks.
+
+    listing tasks enqueue the next listing page and a thread task per recent
+    post; thread tasks park their parsed page in the queue's results table and
+    enqueue further pages; once a thread's pages are all in, an upload task
+    assembles and writes the post. Every step is keyed, so a restarted or
+    extra worker just picks up whatever is still pending.
+    """
+
+    def __init__(self, queue, checkpoints=None, writer=None):
+        self.queue = queue
+        self.checkpoints = checkpoints
+        self.writer = writer
+        self._unflushed = []
+        self._lock = threading.Lock()
+
+    def seed(self, schools, doc_id_for, cutoff=None):
+        cutoff = cutoff or datetime.now(timezone.utc) - timedelta(weeks=2)
+        added = 0
+        for school in schools:
+            if not school.get("uni_id"):
+                print(f"Skipping school '{school['name']}' due to missing uni_id.")
+                continue
+            added += self.queue.enqueue("listing", f"listing:{school['uni_id']}:1", {
+                "uni_id": school["uni_id"],
+                "doc_id": doc_id_for(school),
+                "page": 1,
+                "cutoff": cutoff.isoformat(),
+            })
+        return added
+
+    def _school_doc_ref(self, payload):
+        return (self.writer or get_writer()).client.collection("schools").document(payload["doc_id"])
+
+    def handle(self, task):
+        """Run one task; returns False when completion must wait for commit_uploads()."""
+        if task.kind == "listing":
+            self._listing(task.payload)
+        elif task.kind == "thread":
+            self._thread_page(task.key, task.payload)
+        elif task.kind == "upload":
+            if not self._upload(task.payload):
+                return True
+            with self._lock:
+                self._unflushed.append(task)
+            return False
+        else:
+            raise ValueError(f"Unknown task kind {task.kind!r}")
+        return True
+
+    def _listing(self, payload):
+        uni_id, page = payload["uni_id"], payload["page"]
+        cutoff = datetime.fromisoformat(payload["cutoff"])
+        checkpoint = self.checkpoints.newest_post_date(uni_id) if self.checkpoints else None
+
+        response = fetch(listing_page_url(uni_id, page))
+        if response.status_code != 200:
+            print(f"Failed to retrieve page {page} for uni_id {uni_id}. Status code: {response.status_code}")
+            return
+        parsed = parse_cached(response, "listing", parse_listing_page)
+        if parsed is None:
+            print(f"No discussion boxes found on page {page} for uni_id {uni_id}.")
+            return
+        entries, has_next = parsed
+
+        for entry in entries:
+            if not (entry["post_url"] and entry["date"] and entry["date"] >= cutoff):
+                print(f"Reached posts older than two weeks for uni_id {uni_id}. Stopping.")
+                return
+            if self.checkpoints and thread_is_unchanged(uni_id, entry, self.checkpoints):
+                if self.checkpoints.counters_changed(uni_id, entry):
+                    update_post_counters(entry, self._school_doc_ref(payload), self.writer)
+                    self.checkpoints.record_thread(uni_id, entry)
+                if checkpoint and entry["date"] <= checkpoint:
+                    print(f"Reached the last checkpoint for uni_id {uni_id}. Stopping.")
+                    return
+                continue
+            # Keyed by thread ID, so a thread seen on two listing pages (or under a new title) is queued once
+            self.queue.enqueue("thread", f"thread:{thread_id(entry['post_url'])}:1", {
+                "uni_id": uni_id, "doc_id": payload["doc_id"], "entry": entry_to_payload(entry), "page": 1})
+
+        if has_next:
+            self.queue.enqueue("listing", f"listing:{uni_id}:{page + 1}", {**payload, "page": page + 1})
+
+    def _thread_page(self, task_key, payload):
+        post_url = payload["entry"]["post_url"]
+        number = payload["page"]
+        parsed = fetch_thread_page(post_url, number)
+        self.queue.put_result(task_key, post_url, pickle.dumps((number, parsed)))
+
+        if parsed is not None and parsed[2]:
+            last_page = parsed[3]
+            # Page 1 may tell us every remaining page; otherwise walk NEXT links
+            next_pages = range(2, last_page + 1) if number == 1 and last_page else [number + 1]
+            for next_page in next_pages:
+                self.queue.enqueue("thread", f"thread:{thread_id(post_url)}:{next_page}",
+                                   {**payload, "page": next_page})
+
+        if self._pages(post_url) is not None:
+            self.queue.enqueue("upload", f"upload:{thread_id(post_url)}", payload)
+
+    def _pages(self, post_url):
+        # Parsed pages in order once the thread is complete, else None
+        pages = dict(pickle.loads(data) for _, data in self.queue.results(post_url))
+        ordered = []
+        while len(ordered) + 1 in pages:
+            page = pages[len(ordered) + 1]
+            ordered.append(page)
+            if page is None or not page[2]:
+                return ordered
+        return None
+
+    def _upload(self, payload):
+        # False when there is nothing to upload: the pages are only dropped once an upload was flushed,
+        # so missing pages mean another worker finished this task after its lease ran out here
+        entry = entry_from_payload(payload["entry"])
+        pages = self._pages(entry["post_url"])
+        if pages is None:
+            print(f"Thread {entry['post_url']} was already uploaded; skipping.")
+            return False
+        full_content, comments, pages, last_page_comments = assemble_thread(pages)
+        upload_single_post_to_firestore(build_post(entry, full_content, comments), self._school_doc_ref(payload),
+                                        writer=self.writer)
+        if self.checkpoints:
+            self.checkpoints.record_thread(payload["uni_id"], entry, pages, last_page_comments, len(comments),
+                                           last_comment_date(comments))
+        return True
+
+    def commit_uploads(self, force=False):
+        """Flush the writer and mark the uploads behind it done."""
+        with self._lock:
+            if not self._unflushed or (not force and len(self._unflushed) < UPLOAD_BATCH):
+                return
+            tasks, self._unflushed = self._unflushed, []
+        (self.writer or get_writer()).flush()
+        for task in tasks:
+            self.queue.complete(task)
+            self.queue.drop_results(entry_from_payload(task.payload["entry"])["post_url"])
+        if self.checkpoints:
+            self.checkpoints.save()
+
+# ---------------------- Workers ----------------------
+def run_workers(crawl, threads=4, poll_interval=1.0, worker_id=None):
+    """Drain the queue with `threads` worker threads; returns once nothing is pending or in flight."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    queue = crawl.queue
+
+    def work(n):
+        name = f"{worker_id}:{n}"
+        while True:
+            tasks = queue.claim(name)
+            if not tasks:
+                crawl.commit_uploads(force=True)
+                if queue.is_drained():
+                    return
+                time.sleep(poll_interval)
+                continue
+            task = tasks[0]
+            try:
+                with metrics.span(task.kind, key=task.key):
+                    handled = crawl.handle(task)
+                if handled:
+                    queue.complete(task)
+                crawl.commit_uploads()
+            except Exception as e:
+                state = queue.fail(task, e)
+                print(f"Task {task.key} failed ({state}): {e}")
+                metrics.log("task_failed", kind=task.kind, key=task.key, state=state, error=str(e))
+
+    workers = [threading.Thread(target=work, args=(n,), name=f"queue-worker-{n}") for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    crawl.commit_uploads(force=True)
+
+def report(queue):
+    print(f"Queue: {queue.counts()}")
+    for kind, key, attempts, error in queue.failures():
+        print(f"  failed {kind} {key} after {attempts} attempts: {error}")
+
+if __name__ == "__main__":
+    # Extra workers for a queue seeded by `scrape.py --queue`; several can run at once
+    parser = argparse.ArgumentParser(description="Drain a durable GreekRank crawl queue.")
+    parser.add_argument("--queue", default=DEFAULT_PATH, help="SQLite queue file")
+    parser.add_argument("--threads", type=int, default=4, help="worker threads in this process")
+    parser.add_argument("--comments", choices=comment_store.MODES, default=comment_store.EMBEDDED,
+                        help="where comments are stored; use the same mode as the seeding run")
+    parser.add_argument("--comment-log", default=comment_store.DEFAULT_LOG_PATH,
+                        help="comment IDs already written")
+    parser.add_argument("--fingerprints", default=DEFAULT_FINGERPRINTS,
+                        help="content fingerprints of written documents; unchanged ones are skipped")
+    parser.add_argument("--no-fingerprints", action="store_true", help="write every document, changed or not")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip threads with no new activity; use the same setting as the seeding run")
+    parser.add_argument("--checkpoints", default=DEFAULT_CHECKPOINTS, help="checkpoint file for --incremental")
+    parser.add_argument("--retry-failed", action="store_true", help="requeue tasks that ran out of attempts")
+    parser.add_argument("--metrics-file", help="write Prometheus metrics here (textfile collector format)")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics at :PORT/metrics")
+    parser.add_argument("--json-log", help="append structured JSON log lines here")
+    parser.add_argument("--trace", help="append one JSON span per task here")
+    args = parser.parse_args()
+    metrics.configure(json_log=args.json_log, trace=args.trace, textfile=args.metrics_file, port=args.metrics_port)
+
+    queue = WorkQueue(args.queue)
+    comment_store.configure(args.comments, args.comment_log)
+    fingerprints = None if args.no_fingerprints else FingerprintStore(args.fingerprints)
+    configure_writer(fingerprints=fingerprints)
+    if args.retry_failed:
+        print(f"Requeued {queue.retry_failed()} failed tasks.")
+    crawl = QueueCrawl(queue, checkpoints=CheckpointStore(args.checkpoints) if args.incremental else None)
+    run_workers(crawl, threads=args.threads)
+    get_writer().close()
+    save_comment_log(get_writer())
+    if fingerprints:
+        fingerprints.save()
+    print(f"Firestore writes: {get_writer().summary()}")
+    report(queue)
+    metrics.close()
@@ -0,0 +1,252 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import metrics
+
+# ---------------------- Token Bucket ----------------------
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` banked.
+
+    Usable from plain threads (acquire) and from asyncio code (acquire_async);
+    both paths share the same bucket so mixed callers stay within one budget.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        # Take one token (possibly going negative) and return how long to wait for it
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self):
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+class HostRateLimiter:
+    """One TokenBucket per host, created on first use with the default rate."""
+
+    def __init__(self, rate: float = 1.0, capacity: float = 1.0, per_host=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.per_host = per_host or {}  # host -> (rate, capacity) overrides
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket_for(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                rate, capacity = self.per_host.get(host, (self.rate, self.capacity))
+                bucket = self._buckets[host] = TokenBucket(rate, capacity)
+            return bucket
+
+    def acquire(self, url: str):
+        self.bucket_for(url).acquire()
+
+    async def acquire_async(self, url: str):
+        await self.bucket_for(url).acquire_async()
+
+# ---------------------- Adaptive (AIMD) Limiter ----------------------
+BACKOFF_STATUSES = {429, 500, 502, 503, 504}
+
+class AdaptiveLimit:
+    """Rate and concurrency for one host, tuned AIMD-style from how requests went.
+
+    Every `window` clean responses, or every `interval` seconds of only
+    clean responses when the rate is too low to see that many, add `step`
+    requests/second and one slot of concurrency, up to the ceilings; until
+    the first back-off the rate doubles instead (slow start), so a healthy
+    site is found quickly.
+
+    Both are multiplied by `decrease`, down to the floors, on a 429, on a
+    latency spike, or when more than `error_target` of the last `window`
+    attempts were 5xx or connection errors; at most once per `cooldown`
+    seconds, so one burst of failures counts once. A spike is a response
+    slower than `latency_target`, or when that is None, slower than
+    `spike_factor` times the usual (smoothed) latency.
+    """
+
+    def __init__(self, rate=1.0, min_rate=0.25, max_rate=10.0, concurrency=2, min_concurrency=1,
+                 max_concurrency=16, step=0.5, decrease=0.5, window=20, interval=2.0, error_target=0.05,
+                 latency_target=None, spike_factor=3.0, cooldown=2.0):
+        if not 0 < min_rate <= max_rate:
+            raise ValueError("need 0 < min_rate <= max_rate")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        self.min_rate, self.max_rate = min_rate, max_rate
+        self.min_concurrency, self.max_concurrency = max(min_concurrency, 1), max(max_concurrency, 1)
+        self.step = step
+        self.decrease = decrease
+        self.window = window
+        self.interval = interval
+        self.error_target = error_target
+        self.latency_target = latency_target
+        self.spike_factor = spike_factor
+        self.cooldown = cooldown
+
+        self.bucket = TokenBucket(min(max(rate, min_rate), max_rate), capacity=1.0)
+        self.concurrency = min(max(concurrency, self.min_concurrency), self.max_concurrency)
+        self.in_flight = 0
+        self.increases = 0
+        self.decreases = 0
+        self.latency = None   # smoothed
+        self.baseline = None  # smoothed latency when healthy
+        self._samples = 0
+        self._outcomes = deque(maxlen=window)  # True for each failed attempt
+        self._clean = 0  # clean responses since the last change
+        self._slow_start = True
+        self._last_decrease = 0.0
+        self._last_change = time.monotonic()
+        self._cond = threading.Condition()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def _set_rate(self, rate):
+        with self.bucket._lock:
+            self.bucket.rate = rate
+
+    def _enter(self):
+        with self._cond:
+            while self.in_flight >= self.concurrency:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def acquire(self):
+        self._enter()
+        self.bucket.acquire()
+
+    def release(self, latency, status=None):
+        """Report one finished attempt; status None means it never got a response."""
+        with self._cond:
+            self.in_flight -= 1
+            failed = status is None or status in BACKOFF_STATUSES
+            self._outcomes.append(failed)
+            if status == 429 or (failed and self._error_rate() > self.error_target) or \
+                    (not failed and self._is_spike(latency)):
+                changed = self._back_off()
+            elif failed:
+                # Under the error target: hold steady rather than grow
+                self._clean = 0
+                self._last_change = time.monotonic()
+                changed = False
+            else:
+                changed = self._grow()
+            self._cond.notify_all()
+            if changed:
+                state = self.state()
+        if changed:
+            metrics.log("rate_adjusted", status=status, response_latency=latency, **state)
+        return changed
+
+    def _error_rate(self):
+        # Over a full window even right after a back-off, so a lone failure can't read as 100%
+        return sum(self._outcomes) / self.window
+
+    def _is_spike(self, latency):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.latency_target is not None:
+            return latency > self.latency_target
+        if self.baseline is None or self.latency < self.baseline:
+            self.baseline = self.latency
+        else:
+            self.baseline += (self.latency - self.baseline) * 0.01  # follow slow drifts, not spikes
+        self._samples += 1
+        return latency > self.spike_factor * self.baseline and self._samples >= self.window
+
+    def _back_off(self):
+        self._clean = 0
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return False
+        self._last_decrease = self._last_change = now
+        self._outcomes.clear()
+        self._slow_start = False
+        self.decreases += 1
+        self._set_rate(max(self.min_rate, self.rate * self.decrease))
+        self.concurrency = max(self.min_concurrency, int(self.concurrency * self.decrease))
+        return True
+
+    def _grow(self):
+        self._clean += 1
+        now = time.monotonic()
+        if self._clean < self.window and now - self._last_change < self.interval:
+            return False
+        if self.rate >= self.max_rate and self.concurrency >= self.max_concurrency:
+            return False
+        self._clean = 0
+        self._last_change = now
+        self.increases += 1
+        self._set_rate(min(self.max_rate, self.rate * 2 if self._slow_start else self.rate + self.step))
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        return True
+
+    def state(self) -> dict:
+        return {"rate": round(self.rate, 3), "concurrency": self.concurrency, "in_flight": self.in_flight,
+                "latency": self.latency, "error_rate": self._error_rate(),
+                "increases": self.increases, "decreases": self.decreases}
+
+class AdaptiveRateLimiter:
+    """HostRateLimiter drop-in with an AdaptiveLimit per host.
+
+    HttpClient reports every attempt back through release(), which is what
+    moves the limits; current() tells where they stand.
+    """
+
+    def __init__(self, **options):
+        self.options = options  # AdaptiveLimit arguments
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def limit_for(self, url: str) -> AdaptiveLimit:
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            limit = self._limits.get(host)
+            if limit is None:
+                limit = self._limits[host] = AdaptiveLimit(**self.options)
+            return limit
+
+    def acquire(self, url: str):
+        self.limit_for(url).acquire()
+
+    async def acquire_async(self, url: str):
+        await asyncio.to_thread(self.limit_for(url).acquire)
+
+    def release(self, url: str, latency: float, status=None):
+        limit = self.limit_for(url)
+        if limit.release(latency, status):
+            host = urlsplit(url).netloc.lower()
+            metrics.gauge("greekrank_limiter_rate", limit.rate, host=host)
+            metrics.gauge("greekrank_limiter_concurrency", limit.concurrency, host=host)
+
+    def current(self) -> dict:
+        """{host: rate, concurrency, in-flight requests, smoothed latency and adjustment counts}."""
+        with self._lock:
+            limits = dict(self._limits)
+        return {host: limit.state() for host, limit in limits.items()}
+
+# Shared default for the blocking scrapers: starts at one request per second per
+# host, the pace the old time.sleep(1) calls gave us, and speeds up while the site keeps up.
+polite_limiter = AdaptiveRateLimiter(rate=1.0, min_rate=0.25, max_rate=8.0, concurrency=4, max_concurrency=8)
@@ -0,0 +1,124 @@
+import sys
+from datetime import datetime, timezone
+
+# Sentinels the parsers fill in for missing fields; one shared object each
+ANONYMOUS = sys.intern("Anonymous")
+NO_CONTENT = sys.intern("No content")
+UNTITLED = sys.intern("Untitled")
+
+def intern_author(author):
+    # A busy school has a few regulars and thousands of "Anonymous"; keep one copy of each name
+    return sys.intern(author) if isinstance(author, str) else author
+
+def to_timestamp(date):
+    """Whole UTC seconds for a datetime (GreekRank dates have no sub-second part), or None."""
+    return int(date.timestamp()) if date is not None else None
+
+def to_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp is not None else None
+
+# ---------------------- Record Types ----------------------
+class _Record:
+    """Base for the compact record types: slots instead of a per-object dict, timestamps as ints.
+
+    Records read like the dicts they replace (record["date"], .get(),
+    "key" in record), so code that only reads them doesn't care; to_dict()
+    builds the Firestore/export shape and is only called at the sinks.
+
+    Records pickle as their constructor call (slots are in __init__
+    order), so ones coming back from a parse worker process or the parse
+    cache are re-interned and get the sentinels back.
+    """
+
+    __slots__ = ()
+    fields = ()
+
+    @property
+    def date(self):
+        return to_datetime(self.timestamp)
+
+    def __getitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.fields else default
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def keys(self):
+        return self.fields
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{slot}={getattr(self, slot)!r}' for slot in self.__slots__)})"
+
+class Comment(_Record):
+    __slots__ = ("author", "timestamp", "content")
+    fields = ("author", "date", "content")
+
+    def __init__(self, author, timestamp, content):
+        self.author = intern_author(author)
+        self.timestamp = timestamp
+        self.content = content if content != NO_CONTENT else NO_CONTENT
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["author"], to_timestamp(data["date"]), data["content"])
+
+    def to_dict(self):
+        return {"author": self.author, "date": self.date, "content": self.content}
+
+class Post(_Record):
+    __slots__ = ("title", "post_url", "content", "author", "timestamp", "comments", "views", "upvotes",
+                 "downvotes")
+    fields = ("title", "post_url", "content", "author", "date", "comments", "views", "upvotes", "downvotes")
+
+    def __init__(self, title, post_url, content, author, timestamp, comments, views=0, upvotes=0, downvotes=0):
+        self.title = title if title != UNTITLED else UNTITLED
+        self.post_url = post_url
+        self.content = content if content != NO_CONTENT else NO_CONTENT
+        self.author = intern_author(author)
+        self.timestamp = timestamp
+        self.comments = comments
+        self.views = views
+        self.upvotes = upvotes
+        self.downvotes = downvotes
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["title"], data["post_url"], data["content"], data["author"], to_timestamp(data["date"]),
+                   [as_comment(comment) for comment in data.get("comments", ())], data.get("views", 0),
+                   data.get("upvotes", 0), data.get("downvotes", 0))
+
+    def to_dict(self):
+        # build_post()'s original shape, which is what Firestore and the exports store
+        return {
+            "title": self.title,
+            "post_url": self.post_url,
+            "content": self.content,
+            "author": self.author,
+            "date": self.date,
+            "comments": [comment.to_dict() for comment in self.comments],
+            "views": self.views,
+            "upvotes": self.upvotes,
+            "downvotes": self.downvotes,
+        }
+
+def as_comment(comment):
+    return comment if isinstance(comment, Comment) else Comment.from_dict(comment)
+
+def as_dict(record):
+    """The plain-dict form of a Post or Comment; dicts (e.g. read back from an export) pass through."""
+    return record.to_dict() if isinstance(record, _Record) else record
@@ -0,0 +1,183 @@
+import heapq
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_PATH = "school_activity.json"
+
+DAY = 86400.0
+VIEWS_PER_POST = 50.0    # this much view growth counts as much as one new post
+MIN_INTERVAL = 0.5 * 3600  # never recrawl a school sooner than this (seconds)
+MAX_INTERVAL = 7 * DAY     # ...or leave it alone longer than this
+MIN_EXPECTED = 0.5       # a school is due once this many new posts are expected
+DEFAULT_COST = 5.0       # requests assumed for a school we have no history for
+SMOOTHING = 0.5          # weight of the newest observation in the moving averages
+DORMANT_HALF_LIFE = 3.0  # days without a post, past the usual gap, that halve a school's expected rate
+
+def _parse_iso(value):
+    return datetime.fromisoformat(value) if value else None
+
+# ---------------------- Activity History ----------------------
+class ActivityStore:
+    """Per-school activity history persisted as JSON between runs.
+
+    For each uni_id we keep when it was last crawled, smoothed new posts per
+    day and view growth per day, when its newest post was made, and how many
+    requests a crawl of it took. record() is fed the listing entries a crawl
+    saw; view growth is measured per thread, so a partial (incremental)
+    listing doesn't read as a drop.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self._state = json.load(f)
+        else:
+            self._state = {}
+
+    def school(self, uni_id):
+        with self._lock:
+            state = self._state.get(str(uni_id))
+            return dict(state) if state else None
+
+    def record(self, uni_id, entries, requests=None, now=None, window=timedelta(weeks=2)):
+        """Fold one crawl of a school into its history; `entries` are the listing entries it saw."""
+        now = now or time.time()
+        cutoff = datetime.fromtimestamp(now, timezone.utc) - window
+        with self._lock:
+            state = self._state.setdefault(str(uni_id), {
+                "last_crawl": None, "posts_per_day": None, "views_per_day": None,
+                "newest_post": None, "requests": None, "crawls": 0, "threads": {}})
+            newest = _parse_iso(state["newest_post"])
+            threads = state["threads"]
+
+            new_posts = 0
+            view_growth = 0
+            for entry in entries:
+                if not entry.get("post_url") or not entry.get("date"):
+                    continue
+                known = threads.get(entry["post_url"])
+                if known is None and (newest is None or entry["date"] > newest):
+                    new_posts += 1
+                view_growth += max(0, (entry.get("views") or 0) - (known[0] if known else 0))
+                threads[entry["post_url"]] = [entry.get("views") or 0, entry["date"].isoformat()]
+                if newest is None or entry["date"] > newest:
+                    newest = entry["date"]
+
+            if state["last_crawl"] is None:
+                # First visit: the listing window itself is the history
+                days = window.total_seconds() / DAY
+            else:
+                days = max(now - state["last_crawl"], MIN_INTERVAL) / DAY
+            state["posts_per_day"] = _smooth(state["posts_per_day"], new_posts / days)
+            state["views_per_day"] = _smooth(state["views_per_day"], view_growth / days)
+            if requests is not None:
+                state["requests"] = _smooth(state["requests"], requests)
+            state["newest_post"] = newest.isoformat() if newest else state["newest_post"]
+            state["last_crawl"] = now
+            state["crawls"] += 1
+            for post_url in [url for url, (_, date) in threads.items() if _parse_iso(date) < cutoff]:
+                del threads[post_url]
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self._state, separators=(",", ":"), sort_keys=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+def _smooth(previous, value):
+    return value if previous is None else SMOOTHING * value + (1 - SMOOTHING) * previous
+
+# ---------------------- Scheduler ----------------------
+class Scheduler:
+    """Decide which schools to crawl now, most valuable first, within a request budget.
+
+    A school's value is how many new posts it has probably gathered since
+    its last crawl (posts per day plus view growth, times days since then),
+    per request a crawl of it costs. The averages lag when a school goes
+    quiet, so once its newest post is older than its usual gap between
+    posts the expected rate decays with DORMANT_HALF_LIFE. Schools never
+    crawled come first. A
+    school is due once it is expected to have MIN_EXPECTED new posts, but
+    never within `min_interval` of its last crawl and always after
+    `max_interval`, so busy schools come back every few hours and dormant
+    ones about weekly.
+    """
+
+    def __init__(self, activity, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, min_expected=MIN_EXPECTED):
+        self.activity = activity
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_expected = min_expected
+
+    def rate(self, state, now=None):
+        # Expected new posts per day
+        rate = (state["posts_per_day"] or 0.0) + (state["views_per_day"] or 0.0) / VIEWS_PER_POST
+        return rate * self._freshness(state, now or time.time())
+
+    def _freshness(self, state, now):
+        newest = _parse_iso(state["newest_post"])
+        if newest is None:
+            return 1.0
+        idle = (now - newest.timestamp()) / DAY
+        usual_gap = 1 / state["posts_per_day"] if state["posts_per_day"] else 0.0
+        return 0.5 ** (max(0.0, idle - usual_gap) / DORMANT_HALF_LIFE)
+
+    def interval(self, uni_id, now=None):
+        """Seconds between crawls that this school's activity calls for."""
+        state = self.activity.school(uni_id)
+        if state is None:
+            return 0.0
+        rate = self.rate(state, now)
+        interval = self.min_expected / rate * DAY if rate else self.max_interval
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def _score(self, state, now):
+        # (due, value per request); value is inf for schools we know nothing about
+        if state is None or state["last_crawl"] is None:
+            return True, math.inf
+        age = now - state["last_crawl"]
+        expected = self.rate(state, now) * age / DAY
+        due = age >= self.max_interval or (age >= self.min_interval and expected >= self.min_expected)
+        return due, expected / max(state["requests"] or DEFAULT_COST, 1.0)
+
+    def plan(self, schools, budget=None, now=None):
+        """Due schools in crawl order; with `budget`, only as many as its requests are expected to cover."""
+        now = now or time.time()
+        heap = []
+        for n, school in enumerate(schools):
+            state = self.activity.school(school["uni_id"])
+            due, value = self._score(state, now)
+            if due:
+                cost = (state or {}).get("requests") or DEFAULT_COST
+                heapq.heappush(heap, (-value, n, cost, school))
+
+        planned = []
+        spent = 0.0
+        while heap:
+            _, _, cost, school = heapq.heappop(heap)
+            if budget is not None and spent + cost > budget:
+                if planned:
+                    continue  # a cheaper school further down may still fit
+                # Always make progress, even when one school is over budget on its own
+            planned.append(school)
+            spent += cost
+        return planned
+
+    def next_due(self, schools, now=None):
+        """Seconds until the next school not planned now becomes due (0 if one already is)."""
+        now = now or time.time()
+        waits = []
+        for school in schools:
+            state = self.activity.school(school["uni_id"])
+            if state is None or state["last_crawl"] is None:
+                return 0.0
+            waits.append(max(0.0, state["last_crawl"] + self.interval(school["uni_id"], now) - now))
+        return min(waits) if waits else None
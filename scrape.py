@@ -1,35 +1,40 @@
 import re
-import requests
-import time
-from bs4 import BeautifulSoup
-from google.cloud import firestore
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import partial
+
+from checkpoints import PROBE, UNCHANGED, last_comment_date, probe_unchanged
+import comment_store
+from dedup import SeenThreads
+from firestore_writer import get_db, get_writer
+from http_cache import parse_cached
+from http_client import fetch
+import metrics
+from parsers import (assemble_thread, build_post, listing_page_url, parse_listing_page, parse_school_list,
+                     parse_thread_page, thread_id, thread_page_url)
+from search_index import build_search_fields
 
 # ---------------------- Shared Initialization ----------------------
-db = firestore.Client.from_service_account_json("serviceAccountKey.json")
+thread_page_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="thread-page")
+seen_threads = SeenThreads()  # threads already scraped this run
 
 def slugify_name(name: str) -> str:
     return re.sub(r'[^a-z0-9]+', '_', name.strip().lower()).strip('_')
 
 # ---------------------- Part 1: Fetch & Store Schools ----------------------
 def fetch_schools(url: str):
-    response = requests.get(url)
+    response = fetch(url)
     response.raise_for_status()
+    return parse_schools(response.text)
 
-    soup = BeautifulSoup(response.text, "html.parser")
-
-    # Select all <a> tags with the style attribute containing font-weight:600; 
-    school_links = soup.select('div.inner-container.clearfix.discussions-section div[style*="padding:10px"] a[style*="font-weight:600;"]')
-
+def parse_schools(html):
     schools = []
-    for link in school_links:
-        school_name = link.get_text(strip=True)
+    for school_name, href in parse_school_list(html):
         main_name = school_name.split('-')[0].strip()
         slug = slugify_name(main_name)
         discussion_url = f"/discussions?school={slug}"
 
         # Extract uni_id from the href attribute
-        href = link.get('href', '')
         # Assuming the href contains something like "/uni/62/discussion/"
         uni_id_match = re.search(r'/uni/(\d+)/', href)
         uni_id = uni_id_match.group(1) if uni_id_match else None
@@ -45,261 +50,186 @@ def fetch_schools(url: str):
 
     return schools
 
-def generate_search_index(name: str) -> list:
-    # Split into words
-    words = name.lower().split()
-    search_index = set()
-    
-    for word in words:
-        # Generate prefixes for each word
-        for i in range(1, len(word)+1):
-            prefix = word[:i]
-            search_index.add(prefix)
-    
-    return list(search_index)
-
-def add_school_to_firestore(school):
-    doc_id = slugify_name(school["name"].split('-')[0].strip())
-    lower_name = school["name"].lower()
-    search_index = generate_search_index(school["name"])
-
-    doc_ref = db.collection("schools").document(doc_id)
-    doc_ref.set({
+def add_school_to_firestore(school, writer=None, index_hashes=None):
+    # With index_hashes, the search fields are only rewritten when the name changed
+    writer = writer or get_writer()
+    doc_id = school_doc_id(school)
+    data = {
         "name": school["name"],
         "discussionPageUrl": school["discussionPageUrl"],
-        "nameLowerCase": lower_name,
-        "searchIndex": search_index,
+        "nameLowerCase": school["name"].lower(),
         "uni_id": school.get("uni_id")  # Store uni_id in Firestore
-    })
-    print(f"Added/Updated school: {school['name']} with uni_id: {school.get('uni_id')}")
+    }
+    if index_hashes is None or index_hashes.changed(doc_id, school["name"]):
+        data.update(build_search_fields(school["name"]))
+        if index_hashes is not None:
+            index_hashes.mark(doc_id, school["name"])
+
+    doc_ref = writer.client.collection("schools").document(doc_id)
+    writer.set(doc_ref, data, merge=True)
+    print(f"Queued school: {school['name']} with uni_id: {school.get('uni_id')}")
+
+def save_index_hashes(index_hashes, writer):
+    # Forget hashes for schools whose write failed so the next run retries them
+    for path, _ in writer.failures:
+        if path.startswith("schools/") and path.count("/") == 1:
+            index_hashes.forget(path.split("/", 1)[1])
+    index_hashes.save()
+
+def save_comment_log(writer):
+    comment_log = comment_store.get_log()
+    if comment_log:
+        comment_log.forget_failed(writer.failures)
+        comment_log.prune()
+        comment_log.save()
 
 # ---------------------- Part 2: Scrape Posts for All Schools ----------------------
-def parse_post_date(datetime_str):
-    try:
-        # Parse the datetime string and make it timezone-aware (UTC)
-        return datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
-    except ValueError:
+def fetch_thread_page(post_url, page_number):
+    # Parsed page (see parse_thread_page), or None when the page isn't there
+    response = fetch(thread_page_url(post_url, page_number))
+    if response.status_code != 200:
         return None
+    first_page = page_number == 1
+    return parse_cached(response, "thread-1" if first_page else "thread", parse_thread_page, first_page)
 
-def extract_author(author_tag):
-    if not author_tag:
-        return "Anonymous"
-    author_text = author_tag.get_text(strip=True)
-    author = re.sub(r"^by:\s*", "", author_text, flags=re.IGNORECASE)
-    return author.strip() if author else "Anonymous"
-
-def scrape_post_details(post_url):
-    comments = []
-    main_post_content = None
-    first_page = True
-
-    if post_url.endswith('/'):
-        base_post_url = post_url[:-1]
-    else:
-        base_post_url = post_url
-
-    page_number = 1
-    while True:
-        if page_number == 1:
-            current_url = base_post_url + '/'
-        else:
-            current_url = base_post_url + f'/page-{page_number}/'
-
-        response = requests.get(current_url)
-        if response.status_code != 200:
-            break
+def scrape_thread(post_url):
+    """Fetch every page of a thread.
 
-        page_soup = BeautifulSoup(response.text, "html.parser")
-
-        if first_page:
-            main_post_box = page_soup.select_one(".latest-discussion > .discussion-box.clearfix")
-            if main_post_box:
-                paragraphs = main_post_box.select(".discussion-box-content p")
-                if paragraphs:
-                    full_text = "\n\n".join(p.get_text() for p in paragraphs)
-                    main_post_content = full_text.strip()
-                else:
-                    main_post_content = "No content"
-            first_page = False
+    Page 1's pagination list tells how many pages there are, so the rest are
+    fetched in parallel (still paced by the shared rate limiter); when it
+    doesn't, or the thread grew meanwhile, we follow NEXT links one by one.
+    Returns (main_post_content, comments, pages, last_page_comments); the last
+    two feed the incremental-crawl checkpoints.
+    """
+    pages = [fetch_thread_page(post_url, 1)]
+    if pages[0] is not None:
+        _, _, has_next, last_page = pages[0]
+        if has_next and last_page:
+            pages += thread_page_pool.map(partial(fetch_thread_page, post_url), range(2, last_page + 1))
 
-        reply_boxes = page_soup.select(".discussion-box-reply .discussion-box.clearfix")
-        for reply in reply_boxes:
-            time_tag = reply.select_one(".posted-date time")
-            comment_date = parse_post_date(time_tag['datetime']) if time_tag and time_tag.has_attr('datetime') else None
-
-            author_tag = reply.select_one(".comment") or reply.select_one(".discussion-box-head span span")
-            author = extract_author(author_tag)
-
-            paragraphs = reply.select(".discussion-box-content p")
-            if paragraphs:
-                comment_text = "\n\n".join(p.get_text() for p in paragraphs).strip()
-            else:
-                comment_text = "No content"
-
-            comments.append({
-                "author": author,
-                "date": comment_date,  # Stored as datetime object or None
-                "content": comment_text
-            })
-
-        # Check if NEXT link exists
-        pagination_links = page_soup.select(".post-pagination-list li a")
-        next_link = None
-        for link in pagination_links:
-            if "NEXT" in link.get_text(strip=True).upper():
-                next_link = link
-                break
+    while None not in pages and pages[-1][2]:
+        pages.append(fetch_thread_page(post_url, len(pages) + 1))
 
-        if next_link:
-            page_number += 1
-            time.sleep(1)  # Be polite and avoid hitting the server too hard
-        else:
-            break
+    return assemble_thread(pages)
 
+def scrape_post_details(post_url):
+    main_post_content, comments, _, _ = scrape_thread(post_url)
     return main_post_content, comments
 
-def upload_single_post_to_firestore(post, school_doc_ref):
-    try:
-        # Assuming each post has a unique title; alternatively, use another unique identifier
-        post_id = slugify_name(post['title'])
-        post_ref = school_doc_ref.collection("posts").document(post_id)
-        post_ref.set(post)
-        print(f"Uploaded post: {post['title']} with {len(post['comments'])} comments")
-    except Exception as e:
-        print(f"Error uploading post '{post['title']}': {e}")
-
-def scrape_greekrank_posts(uni_id, school_doc_ref):
-    # Construct base_url using the uni_id
-    base_url = f"https://www.greekrank.com/uni/{uni_id}/discussion/"
+def post_doc_ref(post, school_doc_ref):
+    # Keyed by the thread number from the post URL; titles repeat and change
+    if post.get("post_url"):
+        return school_doc_ref.collection("posts").document(thread_id(post["post_url"]))
+    return school_doc_ref.collection("posts").document(slugify_name(post['title']))
+
+def upload_single_post_to_firestore(post, school_doc_ref, writer=None):
+    # Failed writes are retried and collected by the BufferedWriter, see writer.failures.
+    # Comments go wherever comment_store.configure() says (embedded in the post by default)
+    writer = writer or get_writer()
+    comment_store.write_post(post, post_doc_ref(post, school_doc_ref), writer)
+    metrics.inc("greekrank_posts_total")
+    metrics.log("post_queued", post_url=post.get("post_url"), title=post["title"], comments=len(post["comments"]))
+    print(f"Queued post: {post['title']} with {len(post['comments'])} comments")
+
+def update_post_counters(entry, school_doc_ref, writer=None):
+    # Merge just the listing counters into an existing post document
+    writer = writer or get_writer()
+    writer.set(post_doc_ref(entry, school_doc_ref),
+               {key: entry[key] for key in ("views", "upvotes", "downvotes")}, merge=True)
+
+def thread_is_unchanged(uni_id, entry, checkpoints):
+    action = checkpoints.classify(uni_id, entry)
+    if action == PROBE:
+        # Re-read only the last page we saw instead of the whole thread
+        state = checkpoints.thread(uni_id, entry["post_url"])
+        return probe_unchanged(state, fetch_thread_page(entry["post_url"], state.get("pages") or 1))
+    return action == UNCHANGED
+
+def scrape_greekrank_posts(uni_id, school_doc_ref, checkpoints=None):
+    """Scrape recent posts for one school.
+
+    With a CheckpointStore the crawl is incremental: listing pagination stops
+    at the first already-seen thread with no new activity, and known threads
+    are only re-fetched when their reply count (or last page) changed.
+    """
     two_weeks_ago = datetime.now(timezone.utc) - timedelta(weeks=2)
+    checkpoint = checkpoints.newest_post_date(uni_id) if checkpoints else None
     page = 1
     reached_old_posts = False
+    reached_checkpoint = False
 
-    while True:
-        if page == 1:
-            url = base_url
-        else:
-            url = f"{base_url}page-{page}/"
-
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Failed to retrieve page {page} for uni_id {uni_id}. Status code: {response.status_code}")
-            break
-
-        soup = BeautifulSoup(response.text, "html.parser")
-        discussion_boxes = soup.select(".discussion-box.clearfix")
-        if not discussion_boxes:
-            print(f"No discussion boxes found on page {page} for uni_id {uni_id}.")
-            break
-
-        for post_element in discussion_boxes:
-            title_tag = post_element.select_one("h5.discussion-box-head a")
-            title = title_tag.get_text(strip=True) if title_tag else "Untitled"
-            post_url = title_tag['href'] if title_tag and title_tag.has_attr('href') else None
-            if post_url and post_url.startswith("/"):
-                post_url = "https://www.greekrank.com" + post_url
-
-            # Extract snippet content
-            content_tag = post_element.select_one(".discussion-box-content p")
-            snippet_content = content_tag.get_text().strip() if content_tag else "No content"
-
-            # Extract author
-            author_tag = post_element.select_one(".comment")
-            author = extract_author(author_tag)
-
-            # Extract date
-            time_tag = post_element.select_one(".posted-date time")
-            post_date = parse_post_date(time_tag['datetime']) if time_tag and time_tag.has_attr('datetime') else None
-
-            # Extract upvotes, downvotes, views from the HTML structure
-            like_box = post_element.select_one("ul.like-box")
-            if like_box:
-                # Upvotes and downvotes
-                like_li = like_box.select_one("li.like span")
-                unlike_li = like_box.select_one("li.unlike span")
-
-                upvotes = int(like_li.get_text(strip=True)) if like_li else 0
-                downvotes = int(unlike_li.get_text(strip=True)) if unlike_li else 0
-
-                # Views
-                # The views are typically in the last <li> containing 'Views'
-                # For safety, find the li containing 'Views'
-                views_li = like_box.find(lambda tag: tag.name == "li" and "Views" in tag.get_text())
-                if views_li:
-                    views_text = views_li.get_text(strip=True)
-                    views_match = re.search(r"(\d+)", views_text)
-                    views = int(views_match.group(1)) if views_match else 0
-                else:
-                    views = 0
-            else:
-                # Fallback if like-box isn't found (shouldn't happen typically)
-                upvotes = 0
-                downvotes = 0
-                views = 0
-
-            if post_url and post_date and post_date >= two_weeks_ago:
-                full_content, comments = scrape_post_details(post_url)
-                if not full_content:
-                    full_content = snippet_content
-
-                new_post = {
-                    "title": title,
-                    "content": full_content,
-                    "author": author,
-                    "date": post_date,  # Stored as datetime object with timezone
-                    "comments": comments,
-                    "views": views,
-                    "upvotes": upvotes,
-                    "downvotes": downvotes
-                }
-
-                upload_single_post_to_firestore(new_post, school_doc_ref)
-            else:
-                # We've hit an older or invalid post
-                reached_old_posts = True
+    with metrics.span("school", uni_id=uni_id):
+        while True:
+            url = listing_page_url(uni_id, page)
+
+            response = fetch(url)
+            if response.status_code != 200:
+                print(f"Failed to retrieve page {page} for uni_id {uni_id}. Status code: {response.status_code}")
                 break
 
-        if reached_old_posts:
-            print(f"Reached posts older than two weeks for uni_id {uni_id}. Stopping.")
-            break
+            parsed = parse_cached(response, "listing", parse_listing_page)
+            if parsed is None:
+                print(f"No discussion boxes found on page {page} for uni_id {uni_id}.")
+                break
+            entries, has_next = parsed
+
+            for entry in entries:
+                if not (entry["post_url"] and entry["date"] and entry["date"] >= two_weeks_ago):
+                    # We've hit an older or invalid post
+                    reached_old_posts = True
+                    break
+
+                if not seen_threads.claim(entry["post_url"]):
+                    # Already scraped this run; it moved to a later listing page meanwhile
+                    continue
+
+                if checkpoints and thread_is_unchanged(uni_id, entry, checkpoints):
+                    if checkpoints.counters_changed(uni_id, entry):
+                        update_post_counters(entry, school_doc_ref)
+                        checkpoints.record_thread(uni_id, entry)
+                    if checkpoint and entry["date"] <= checkpoint:
+                        reached_checkpoint = True
+                        break
+                    continue
+
+                try:
+                    with metrics.span("post", uni_id=uni_id, post_url=entry["post_url"]):
+                        full_content, comments, pages, last_page_comments = scrape_thread(entry["post_url"])
+                        upload_single_post_to_firestore(build_post(entry, full_content, comments), school_doc_ref)
+                except Exception:
+                    seen_threads.release(entry["post_url"])
+                    raise
+                if checkpoints:
+                    checkpoints.record_thread(uni_id, entry, pages, last_page_comments, len(comments),
+                                              last_comment_date(comments))
+
+            if reached_old_posts or reached_checkpoint:
+                if reached_old_posts:
+                    print(f"Reached posts older than two weeks for uni_id {uni_id}. Stopping.")
+                else:
+                    print(f"Reached the last checkpoint for uni_id {uni_id}. Stopping.")
+                break
 
-        # Check for next page
-        pagination_links = soup.select(".post-pagination-list li a")
-        next_link = None
-        for link in pagination_links:
-            if "NEXT" in link.get_text(strip=True).upper():
-                next_link = link
+            if has_next:
+                page += 1
+            else:
+                print(f"No more pages to scrape for uni_id {uni_id}.")
                 break
 
-        if next_link:
-            page += 1
-            time.sleep(1)  # Be polite and avoid hitting the server too hard
-        else:
-            print(f"No more pages to scrape for uni_id {uni_id}.")
-            break
+    if checkpoints:
+        checkpoints.prune(uni_id, two_weeks_ago)
+        checkpoints.save()
 
 # ---------------------- Main Execution ----------------------
+def school_doc_id(school):
+    return slugify_name(school["name"].split('-')[0].strip())
+
+def school_doc_ref_for(school):
+    return get_db().collection("schools").document(school_doc_id(school))
+
 if __name__ == "__main__":
-    print("Fetching all schools...")
-    all_schools = fetch_schools("https://www.greekrank.com/list/")
-    
-    # Add all schools to Firestore
-    for s in all_schools:
-        add_school_to_firestore(s)
-    
-    print("Starting to scrape posts for all schools...")
-    
-    for school in all_schools:
-        uni_id = school.get("uni_id")
-        if not uni_id:
-            print(f"Skipping school '{school['name']}' due to missing uni_id.")
-            continue
-
-        # Define Firestore document reference for the current school
-        school_doc_ref = db.collection("schools").document(slugify_name(school["name"].split('-')[0].strip()))
-        
-        print(f"Scraping posts from GreekRank for {school['name']} (uni_id: {uni_id})...")
-        scrape_greekrank_posts(uni_id, school_doc_ref)
-        print(f"Finished scraping posts for {school['name']}.\n")
-    
-    print("All scraping tasks completed.")
\ No newline at end of file
+    # Same as `python cli.py posts ...`, kept for existing cron jobs and docs
+    import sys
+    from cli import main
+
+    main(["posts", *sys.argv[1:]])
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+
+MAX_PREFIX_LENGTH = 10   # longer prefixes add little beyond the whole word
+MAX_INDEX_TERMS = 120    # cap on searchIndex + searchTrigrams per school document
+INDEX_VERSION = 2        # bump when build_search_fields changes, so stored search fields get rebuilt
+DEFAULT_HASH_PATH = "search_index_hashes.json"
+
+# ---------------------- Index Builder ----------------------
+def normalize(name: str) -> str:
+    # "Université de Montréal - UdeM" -> "universite de montreal udem"
+    text = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+def trigrams(text: str) -> set:
+    """Character trigrams of each word, padded so short words and word starts count."""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def name_hash(name: str) -> str:
+    return hashlib.sha1(f"{INDEX_VERSION}:{normalize(name)}".encode()).hexdigest()[:16]
+
+def build_search_fields(name: str, max_terms=MAX_INDEX_TERMS) -> dict:
+    """Compact search fields for a school document.
+
+    searchIndex keeps the array-contains prefix lookups working: every whole
+    word plus its prefixes up to MAX_PREFIX_LENGTH characters, deduplicated
+    and shortest first. Words are taken both as the old index split them
+    (lowercased, punctuation kept: "a&m") and normalized ("a", "m"), so
+    either query form matches; a query for part of a word longer than
+    MAX_PREFIX_LENGTH has to be cut to that length. searchTrigrams backs
+    typo-tolerant matching. Together they never exceed `max_terms` entries;
+    whole words and short prefixes win when the cap bites. searchIndexHash
+    tells whether a rewrite is due.
+    """
+    text = normalize(name)
+    words = set(text.split()) | set(name.lower().split())
+
+    prefixes = set(words)
+    for word in words:
+        prefixes.update(word[:i] for i in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1))
+    # Whole words first, then shorter prefixes, so truncation drops the least useful terms
+    ranked = sorted(prefixes, key=lambda term: (term not in words, len(term), term))
+    prefix_terms = ranked[:max_terms]
+
+    trigram_terms = sorted(trigrams(text))[:max(0, max_terms - len(prefix_terms))]
+    return {
+        "searchIndex": sorted(prefix_terms),
+        "searchTrigrams": trigram_terms,
+        "searchIndexHash": name_hash(name),
+    }
+
+class SearchIndexHashes:
+    """Local record of the name hash each school's search fields were last written for."""
+
+    def __init__(self, path=DEFAULT_HASH_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self._hashes = json.load(f)
+        else:
+            self._hashes = {}
+
+    def changed(self, doc_id, name):
+        with self._lock:
+            return self._hashes.get(doc_id) != name_hash(name)
+
+    def mark(self, doc_id, name):
+        with self._lock:
+            self._hashes[doc_id] = name_hash(name)
+
+    def forget(self, doc_id):
+        with self._lock:
+            self._hashes.pop(doc_id, None)
+
+    def save(self):
+        with self._lock:
+            data = json.dumps(self._hashes, indent=1, sort_keys=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+# ---------------------- Local Query API ----------------------
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children = {}
+        self.ids = set()  # every id with a word passing through this node
+
+class SchoolSearch:
+    """In-memory autocomplete over school names.
+
+    A word trie answers prefix queries ("univ of mich") and a trigram
+    inverted index answers fuzzy ones ("michgan"), so a search box can be
+    served locally instead of querying Firestore on every keystroke.
+    """
+
+    def __init__(self):
+        self._root = _TrieNode()
+        self._trigrams = {}
+        self._names = {}
+
+    @classmethod
+    def from_schools(cls, schools, doc_id_for):
+        search = cls()
+        for school in schools:
+            search.add(doc_id_for(school), school["name"])
+        return search
+
+    @classmethod
+    def from_firestore(cls, client):
+        # One read of the schools collection, then every lookup stays local
+        search = cls()
+        for snapshot in client.collection("schools").stream():
+            data = snapshot.to_dict() or {}
+            if data.get("name"):
+                search.add(snapshot.id, data["name"])
+        return search
+
+    def add(self, doc_id, name):
+        self._names[doc_id] = name
+        text = normalize(name)
+        for word in text.split():
+            node = self._root
+            for char in word:
+                node = node.children.setdefault(char, _TrieNode())
+                node.ids.add(doc_id)
+        for gram in trigrams(text):
+            self._trigrams.setdefault(gram, set()).add(doc_id)
+
+    def _prefix_ids(self, prefix):
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.ids
+
+    def autocomplete(self, query, limit=10):
+        """(doc_id, name) pairs whose words start with every word of the query."""
+        words = normalize(query).split()
+        if not words:
+            return []
+        ids = None
+        for word in words:
+            matches = self._prefix_ids(word)
+            ids = set(matches) if ids is None else ids & matches
+            if not ids:
+                return []
+        ranked = sorted(ids, key=lambda doc_id: (len(self._names[doc_id]), self._names[doc_id]))
+        return [(doc_id, self._names[doc_id]) for doc_id in ranked[:limit]]
+
+    def fuzzy(self, query, limit=10, min_score=0.5):
+        """(doc_id, name, score) by the share of the query's trigrams found in the name; tolerates typos."""
+        query_grams = trigrams(normalize(query))
+        if not query_grams:
+            return []
+        shared = {}
+        for gram in query_grams:
+            for doc_id in self._trigrams.get(gram, ()):
+                shared[doc_id] = shared.get(doc_id, 0) + 1
+        scored = [(count / len(query_grams), doc_id) for doc_id, count in shared.items()
+                  if count / len(query_grams) >= min_score]
+        # Ties go to the shorter name, which the query covers more of
+        scored.sort(key=lambda item: (-item[0], len(self._names[item[1]]), self._names[item[1]]))
+        return [(doc_id, self._names[doc_id], round(score, 3)) for score, doc_id in scored[:limit]]
+
+    def search(self, query, limit=10):
+        # Prefix matches first; fall back to fuzzy matching for typos
+        results = self.autocomplete(query, limit)
+        if len(results) < limit:
+            seen = {doc_id for doc_id, _ in results}
+            results += [(doc_id, name) for doc_id, name, _ in self.fuzzy(query, limit)
+                        if doc_id not in seen][:limit - len(results)]
+        return results
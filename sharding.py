@@ -0,0 +1,334 @@
+import argparse
+import asyncio
+import bisect
+import hashlib
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import date
+from urllib.parse import urlsplit
+
+DEFAULT_PATH = "crawl_shards.db"
+DEFAULT_SHARDS = 16
+MAX_SCHOOL_ATTEMPTS = 3  # per worker and run; a school failing this often is left unfinished
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shards (
+    shard INTEGER PRIMARY KEY,
+    owner TEXT,
+    lease_expires REAL,
+    done_run TEXT
+);
+CREATE TABLE IF NOT EXISTS progress (
+    run_id TEXT NOT NULL,
+    uni_id TEXT NOT NULL,
+    worker_id TEXT,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (run_id, uni_id)
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    host TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# ---------------------- Consistent Hashing ----------------------
+def _hash(value):
+    return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], "big")
+
+class HashRing:
+    """Maps uni_ids onto `shards` shards with `replicas` virtual nodes each.
+
+    A school's shard depends only on its uni_id and the shard count, so
+    schools appearing or disappearing on /list/ never move the others, and
+    changing the shard count only moves about 1/shards of them.
+    """
+
+    def __init__(self, shards=DEFAULT_SHARDS, replicas=64):
+        self.shards = shards
+        points = sorted((_hash(f"shard-{shard}-{n}"), shard) for shard in range(shards) for n in range(replicas))
+        self._keys = [key for key, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, uni_id):
+        index = bisect.bisect(self._keys, _hash(uni_id)) % len(self._keys)
+        return self._shards[index]
+
+    def partition(self, schools):
+        """{shard: [school, ...]} for schools with a uni_id."""
+        shards = {}
+        for school in schools:
+            if school.get("uni_id"):
+                shards.setdefault(self.shard_for(school["uni_id"]), []).append(school)
+        return shards
+
+# ---------------------- Lease Store ----------------------
+class LeaseStore:
+    """SQLite coordinator shared by every shard worker.
+
+    Workers heartbeat into `workers`; a worker that stops for longer than
+    `lease_seconds` is presumed dead and its shard leases lapse. balance()
+    hands each live worker a fair share of the shards still pending in the
+    current run, so survivors pick up a dead worker's shards and newcomers
+    take some off busy ones. The same file holds the global per-host token
+    buckets behind SharedRateLimiter and which schools each run finished.
+
+    Every worker on one machine (or on hosts sharing the file over a
+    filesystem with working locks) can point at the same path.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, lease_seconds=60):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    def heartbeat(self, worker_id):
+        """Mark the worker alive and extend its shard leases."""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO workers (worker_id, heartbeat) VALUES (?, ?) "
+                         "ON CONFLICT(worker_id) DO UPDATE SET heartbeat = excluded.heartbeat", (worker_id, now))
+            conn.execute("UPDATE shards SET lease_expires = ? WHERE owner = ?", (now + self.lease_seconds, worker_id))
+
+    def balance(self, worker_id, shards, run_id):
+        """Claim or give back shards so this worker holds its fair share; returns the shards it owns."""
+        now = time.time()
+        with self._transaction() as conn:
+            _add_shards(conn, shards)
+            conn.execute("UPDATE shards SET owner = NULL WHERE lease_expires < ?", (now,))
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - self.lease_seconds,))
+            live = conn.execute("SELECT COUNT(*) FROM workers").fetchone()[0] or 1
+            pending = conn.execute("SELECT COUNT(*) FROM shards WHERE shard < ? AND done_run IS NOT ?",
+                                   (shards, run_id)).fetchone()[0]
+            fair = math.ceil(pending / live)
+
+            mine = [row[0] for row in conn.execute(
+                "SELECT shard FROM shards WHERE owner = ? AND done_run IS NOT ? ORDER BY shard",
+                (worker_id, run_id))]
+            if len(mine) > fair:
+                extra = mine[fair:]
+                conn.executemany("UPDATE shards SET owner = NULL WHERE shard = ?", [(n,) for n in extra])
+                mine = mine[:fair]
+            elif len(mine) < fair:
+                free = [row[0] for row in conn.execute(
+                    "SELECT shard FROM shards WHERE owner IS NULL AND shard < ? AND done_run IS NOT ? "
+                    "ORDER BY shard LIMIT ?", (shards, run_id, fair - len(mine)))]
+                conn.executemany("UPDATE shards SET owner = ?, lease_expires = ? WHERE shard = ?",
+                                 [(worker_id, now + self.lease_seconds, n) for n in free])
+                mine += free
+            return sorted(mine)
+
+    def owns(self, worker_id, shard):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner FROM shards WHERE shard = ?", (shard,)).fetchone()
+        return row is not None and row[0] == worker_id
+
+    def finished(self, run_id):
+        with self._transaction() as conn:
+            return {row[0] for row in conn.execute("SELECT uni_id FROM progress WHERE run_id = ?", (run_id,))}
+
+    def mark_school(self, run_id, uni_id, worker_id):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO progress (run_id, uni_id, worker_id, finished_at) "
+                         "VALUES (?, ?, ?, ?)", (run_id, str(uni_id), worker_id, time.time()))
+
+    def mark_shard(self, run_id, shard):
+        with self._transaction() as conn:
+            conn.execute("UPDATE shards SET done_run = ?, owner = NULL WHERE shard = ?", (run_id, shard))
+
+    def run_done(self, run_id, shards):
+        with self._transaction() as conn:
+            _add_shards(conn, shards)
+            return conn.execute("SELECT COUNT(*) FROM shards WHERE shard < ? AND done_run IS NOT ?",
+                                (shards, run_id)).fetchone()[0] == 0
+
+    def release(self, worker_id):
+        with self._transaction() as conn:
+            conn.execute("UPDATE shards SET owner = NULL WHERE owner = ?", (worker_id,))
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+    def take_token(self, host, rate, capacity):
+        """Take one token from the host's shared bucket; returns how long to wait for it."""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE host = ?", (host,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate) - 1
+            conn.execute("INSERT OR REPLACE INTO buckets (host, tokens, updated) VALUES (?, ?, ?)",
+                         (host, tokens, now))
+        return 0.0 if tokens >= 0 else -tokens / rate
+
+def _add_shards(conn, shards):
+    conn.executemany("INSERT OR IGNORE INTO shards (shard) VALUES (?)", [(n,) for n in range(shards)])
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+class SharedRateLimiter:
+    """HostRateLimiter drop-in whose buckets live in the LeaseStore, so all workers share one budget."""
+
+    def __init__(self, store, rate=1.0, capacity=1.0):
+        self.store = store
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+
+    def _reserve(self, url):
+        return self.store.take_token(urlsplit(url).netloc.lower(), self.rate, self.capacity)
+
+    def acquire(self, url):
+        delay = self._reserve(url)
+        if delay:
+            time.sleep(delay)
+
+    async def acquire_async(self, url):
+        delay = await asyncio.to_thread(self._reserve, url)
+        if delay:
+            await asyncio.sleep(delay)
+
+# ---------------------- Shard Worker ----------------------
+def run_shard_worker(store, schools, crawl_school, worker_id=None, shards=DEFAULT_SHARDS, run_id=None,
+                     poll_interval=5.0, flush=None, max_attempts=MAX_SCHOOL_ATTEMPTS):
+    """Crawl whatever shards this worker holds until every shard of the run is done.
+
+    `crawl_school(school)` does the work for one school; `flush()`, when
+    given, makes its buffered writes durable and returns False if any of
+    them failed. Only schools that got through both are recorded as
+    finished for the run, so a shard taken over from a dead worker resumes
+    where it stopped and lost work is redone. A failing school is retried
+    up to `max_attempts` times before its shard is let go without it.
+    Returns the number of schools this worker crawled.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    run_id = run_id or date.today().isoformat()
+    ring = HashRing(shards)
+    by_shard = ring.partition(schools)
+    crawled = 0
+    attempts = {}  # uni_id -> failed attempts in this worker
+
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(store.lease_seconds / 3):
+            store.heartbeat(worker_id)
+
+    store.heartbeat(worker_id)
+    heart = threading.Thread(target=beat, name="shard-heartbeat", daemon=True)
+    heart.start()
+    try:
+        while not store.run_done(run_id, shards):
+            # Rebalance between shards so workers that join later get their share early
+            owned = store.balance(worker_id, shards, run_id)
+            if not owned:
+                time.sleep(poll_interval)
+                continue
+            shard = owned[0]
+            print(f"[{worker_id}] crawling shard {shard} (holding {owned})")
+            finished = store.finished(run_id)
+            given_up = []
+            for school in by_shard.get(shard, []):
+                uni_id = str(school["uni_id"])
+                if uni_id in finished:
+                    continue
+                if attempts.get(uni_id, 0) >= max_attempts:
+                    given_up.append(school["name"])
+                    continue
+                if not store.owns(worker_id, shard):
+                    print(f"[{worker_id}] lost shard {shard}; leaving it to its new owner")
+                    break
+                try:
+                    crawl_school(school)
+                    if flush is not None and not flush():
+                        raise RuntimeError("some of its Firestore writes failed")
+                except Exception as e:
+                    attempts[uni_id] = attempts.get(uni_id, 0) + 1
+                    print(f"[{worker_id}] error scraping {school['name']} "
+                          f"(attempt {attempts[uni_id]}/{max_attempts}): {e}")
+                    if attempts[uni_id] < max_attempts:
+                        break  # back to balance(); the shard is retried while this worker holds it
+                    given_up.append(school["name"])
+                else:
+                    store.mark_school(run_id, school["uni_id"], worker_id)
+                    crawled += 1
+            else:
+                if given_up:
+                    print(f"[{worker_id}] shard {shard} done without {given_up} after {max_attempts} attempts each")
+                store.mark_shard(run_id, shard)
+    finally:
+        stop.set()
+        store.release(worker_id)
+    return crawled
+
+if __name__ == "__main__":
+    # Start one of these per worker (per machine or per core); they split the schools between them
+    import firestore_writer
+    import http_client
+    import parsers
+    from scrape import fetch_schools, school_doc_ref_for, scrape_greekrank_posts
+
+    parser = argparse.ArgumentParser(description="Crawl a consistent-hash slice of GreekRank schools.")
+    parser.add_argument("--store", default=DEFAULT_PATH, help="SQLite lease store shared by all workers")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS, help="shard count; same on every worker")
+    parser.add_argument("--run-id", help="crawl run these workers belong to (default: today's date)")
+    parser.add_argument("--worker-id", help="default: host:pid")
+    parser.add_argument("--lease", type=float, default=60, help="seconds without a heartbeat before reassignment")
+    parser.add_argument("--rate", type=float, default=2.0, help="requests per second for ALL workers together")
+    parser.add_argument("--burst", type=float, default=4, help="shared token bucket size")
+    parser.add_argument("--base-url", help="crawl this site instead, e.g. the bench.py --serve stub")
+    parser.add_argument("--fake-firestore", action="store_true", help="write to an in-memory Firestore")
+    args = parser.parse_args()
+
+    if args.base_url:
+        parsers.BASE_URL = args.base_url.rstrip("/")
+    if args.fake_firestore:
+        import fake_firestore
+
+        firestore_writer.use_client(fake_firestore.Client())
+
+    store = LeaseStore(args.store, lease_seconds=args.lease)
+    http_client.configure(limiter=SharedRateLimiter(store, rate=args.rate, capacity=args.burst))
+    all_schools = fetch_schools(f"{parsers.BASE_URL}/list/")
+
+    def crawl_school(school):
+        print(f"Scraping posts from GreekRank for {school['name']} (uni_id: {school['uni_id']})...")
+        scrape_greekrank_posts(school["uni_id"], school_doc_ref_for(school))
+
+    def flush():
+        # A school only counts as finished once its writes are in Firestore
+        writer = firestore_writer.get_writer()
+        failed = len(writer.failures)
+        writer.flush()
+        return len(writer.failures) == failed
+
+    crawled = run_shard_worker(store, all_schools, crawl_school, worker_id=args.worker_id, shards=args.shards,
+                               run_id=args.run_id, flush=flush)
+    writer = firestore_writer.get_writer()
+    writer.close()
+    print(f"Crawled {crawled} schools. Firestore writes: {writer.summary()}")
@@ -0,0 +1,349 @@
+import gzip
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from records import Comment, Post, as_dict, to_timestamp
+from stream import COMMENT, POST, POST_END, SCHOOL
+
+FIRESTORE = "firestore"
+JSONL = "jsonl"
+PARQUET = "parquet"
+SINKS = (FIRESTORE, JSONL, PARQUET)
+
+ROW_GROUP_SIZE = 10000  # rows buffered per partition before they are written out
+MAX_OPEN_FILES = 64     # Parquet writers kept open at once
+
+# Columns per table, in file order
+COLUMNS = {
+    "schools": ("uni_id", "name", "discussionPageUrl"),
+    "posts": ("uni_id", "post_url", "title", "content", "author", "date", "views", "upvotes", "downvotes"),
+    "comments": ("uni_id", "post_url", "index", "author", "date", "content"),
+}
+TABLES = {SCHOOL: "schools", POST: "posts", COMMENT: "comments"}
+
+# ---------------------- Sink Interface ----------------------
+class Sink:
+    """Where scraped schools, posts and comments end up.
+
+    write_school() takes fetch_schools() dicts and write_post() a
+    records.Post (or a dict of the same shape); write_record() takes
+    stream.py records. By default records are reassembled into posts, so a
+    sink only has to implement the first two.
+    """
+
+    def __init__(self):
+        self._open_posts = {}
+
+    def write_school(self, school):
+        raise NotImplementedError
+
+    def write_post(self, uni_id, post):
+        raise NotImplementedError
+
+    def write_record(self, record):
+        kind = record["kind"]
+        if kind == SCHOOL:
+            self.write_school({key: value for key, value in record.items() if key != "kind"})
+        elif kind == POST:
+            # Posts in progress are held as compact records until their POST_END
+            self._open_posts[record["uni_id"], record["post_url"]] = Post(
+                record["title"], record["post_url"], record["content"], record["author"],
+                to_timestamp(record["date"]), [], record["views"], record["upvotes"], record["downvotes"])
+        elif kind == COMMENT:
+            self._open_posts[record["uni_id"], record["post_url"]].comments.append(
+                Comment(record["author"], to_timestamp(record["date"]), record["content"]))
+        elif kind == POST_END:
+            self.write_post(record["uni_id"], self._open_posts.pop((record["uni_id"], record["post_url"])))
+
+    def close(self):
+        pass
+
+    def summary(self) -> dict:
+        return {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FirestoreSink(Sink):
+    """The original destination: schools/{school}/posts/{thread}, through the shared BufferedWriter."""
+
+    def __init__(self, writer=None, index_hashes=None):
+        super().__init__()
+        from firestore_writer import get_writer
+
+        self.writer = writer or get_writer()
+        self.index_hashes = index_hashes
+        self._school_refs = {}  # uni_id -> school document
+
+    def write_school(self, school):
+        from scrape import add_school_to_firestore, school_doc_id
+
+        add_school_to_firestore(school, self.writer, self.index_hashes)
+        self._school_refs[school["uni_id"]] = self.writer.client.collection("schools").document(school_doc_id(school))
+
+    def write_post(self, uni_id, post):
+        from scrape import upload_single_post_to_firestore
+
+        if uni_id not in self._school_refs:
+            raise ValueError(f"Post for uni_id {uni_id} before its school")
+        upload_single_post_to_firestore(post, self._school_refs[uni_id], self.writer)
+
+    def close(self):
+        self.writer.flush()
+
+    def summary(self) -> dict:
+        return self.writer.summary()
+
+class DryRunSink(Sink):
+    """Counts what would have been written and drops it (--dry-run)."""
+
+    def __init__(self):
+        super().__init__()
+        self.rows = {table: 0 for table in COLUMNS}
+
+    def write_school(self, school):
+        self.rows["schools"] += 1
+
+    def write_post(self, uni_id, post):
+        self.rows["posts"] += 1
+        self.rows["comments"] += len(post["comments"])
+
+    def write_record(self, record):
+        table = TABLES.get(record["kind"])
+        if table:
+            self.rows[table] += 1
+
+    def summary(self) -> dict:
+        return dict(self.rows)
+
+# ---------------------- Partitioned Files ----------------------
+def _date_partition(value):
+    return value.strftime("%Y-%m-%d") if value else "unknown"
+
+def _partition(table, row):
+    # Hive-style directories, so pyarrow.dataset / DuckDB / Spark read them as partition columns
+    if table == "schools":
+        return f"school={row['uni_id']}"
+    return f"school={row['uni_id']}/date={_date_partition(row['date'])}"
+
+class _PartitionedSink(Sink):
+    """Buffers rows per table and partition, handing them to _write_rows() ROW_GROUP_SIZE at a time.
+
+    Files are laid out as {root}/{table}/school={uni_id}[/date={YYYY-MM-DD}]/part-{run}-{n}.{ext}.
+    Posts and comments are partitioned by their own date; every run writes
+    its own part files, so several exports can share a root.
+    """
+
+    extension = None
+
+    def __init__(self, root, row_group_size=ROW_GROUP_SIZE):
+        super().__init__()
+        self.root = root
+        self.row_group_size = row_group_size
+        self.run = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.rows = {table: 0 for table in COLUMNS}
+        self._buffers = {}  # (table, partition) -> rows
+
+    def _path(self, table, partition, part=0):
+        directory = os.path.join(self.root, table, partition)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"part-{self.run}-{part:05d}.{self.extension}")
+
+    def _add(self, table, row):
+        key = (table, _partition(table, row))
+        rows = self._buffers.setdefault(key, [])
+        rows.append({column: row.get(column) for column in COLUMNS[table]})
+        self.rows[table] += 1
+        if len(rows) >= self.row_group_size:
+            del self._buffers[key]
+            self._write_rows(*key, rows)
+
+    def write_school(self, school):
+        self._add("schools", school)
+
+    def write_post(self, uni_id, post):
+        post = as_dict(post)
+        self._add("posts", {**post, "uni_id": uni_id})
+        for index, comment in enumerate(post["comments"]):
+            self._add("comments", {**comment, "uni_id": uni_id, "post_url": post["post_url"], "index": index})
+
+    def write_record(self, record):
+        # Rows go out as records arrive; nothing waits for POST_END
+        table = TABLES.get(record["kind"])
+        if table:
+            self._add(table, record)
+
+    def flush(self):
+        buffers, self._buffers = self._buffers, {}
+        for (table, partition), rows in buffers.items():
+            self._write_rows(table, partition, rows)
+
+    def close(self):
+        self.flush()
+
+    def summary(self) -> dict:
+        return {"root": self.root, **self.rows}
+
+    def _write_rows(self, table, partition, rows):
+        raise NotImplementedError
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+class JsonlSink(_PartitionedSink):
+    """Gzipped JSON lines; each row group is appended as its own gzip member, so no file stays open."""
+
+    extension = "jsonl.gz"
+
+    def __init__(self, root, row_group_size=ROW_GROUP_SIZE, compresslevel=6):
+        super().__init__(root, row_group_size)
+        self.compresslevel = compresslevel
+
+    def _write_rows(self, table, partition, rows):
+        data = "".join(json.dumps(row, default=_json_default, separators=(",", ":")) + "\n" for row in rows)
+        with gzip.open(self._path(table, partition), "at", compresslevel=self.compresslevel) as f:
+            f.write(data)
+
+class ParquetSink(_PartitionedSink):
+    """Parquet files with one row group per ROW_GROUP_SIZE rows; needs pyarrow.
+
+    At most `max_open_files` writers stay open; when one is evicted its
+    partition continues in a new part file.
+    """
+
+    extension = "parquet"
+
+    def __init__(self, root, row_group_size=ROW_GROUP_SIZE, compression="zstd", max_open_files=MAX_OPEN_FILES):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("The Parquet sink needs pyarrow (pip install pyarrow); "
+                              "use the jsonl sink otherwise") from e
+        super().__init__(root, row_group_size)
+        self._pa, self._pq = pa, pq
+        self.compression = compression
+        self.max_open_files = max_open_files
+        timestamp = pa.timestamp("us", tz="UTC")
+        types = {"uni_id": pa.string(), "date": timestamp, "views": pa.int64(), "upvotes": pa.int64(),
+                 "downvotes": pa.int64(), "index": pa.int64()}
+        self.schemas = {table: pa.schema([(column, types.get(column, pa.string())) for column in columns])
+                        for table, columns in COLUMNS.items()}
+        self._writers = OrderedDict()  # (table, partition) -> ParquetWriter, least recently used first
+        self._parts = {}               # (table, partition) -> part files started
+
+    def _writer(self, table, partition):
+        key = (table, partition)
+        writer = self._writers.get(key)
+        if writer is not None:
+            self._writers.move_to_end(key)
+            return writer
+        if len(self._writers) >= self.max_open_files:
+            _, evicted = self._writers.popitem(last=False)
+            evicted.close()
+        part = self._parts.get(key, 0)
+        self._parts[key] = part + 1
+        writer = self._writers[key] = self._pq.ParquetWriter(self._path(table, partition, part),
+                                                             self.schemas[table], compression=self.compression)
+        return writer
+
+    def _write_rows(self, table, partition, rows):
+        batch = self._pa.Table.from_pylist(rows, schema=self.schemas[table])
+        self._writer(table, partition).write_table(batch, row_group_size=len(rows))
+
+    def close(self):
+        super().close()
+        while self._writers:
+            self._writers.popitem()[1].close()
+
+def open_sink(kind, root=None, **kwargs):
+    if kind == FIRESTORE:
+        return FirestoreSink(**kwargs)
+    if root is None:
+        raise ValueError(f"The {kind} sink needs an output directory")
+    if kind == JSONL:
+        return JsonlSink(root, **kwargs)
+    if kind == PARQUET:
+        return ParquetSink(root, **kwargs)
+    raise ValueError(f"Unknown sink {kind!r}; expected one of {SINKS}")
+
+# ---------------------- Reading Exports Back ----------------------
+def _read_rows(path):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        yield from pq.read_table(path).to_pylist()
+    elif path.endswith(".jsonl.gz"):
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                row = json.loads(line)
+                if row.get("date"):
+                    row["date"] = datetime.fromisoformat(row["date"])
+                yield row
+
+def _run(name):
+    # "part-{run}-{n}.{ext}" -> run, which sorts in export order
+    return name[len("part-"):].split(".", 1)[0].rsplit("-", 1)[0]
+
+def _table_rows(root, table, school=None):
+    """(run, row) for every row of a table, optionally of one school partition."""
+    base = os.path.join(root, table, school) if school else os.path.join(root, table)
+    for directory, _, files in sorted(os.walk(base)):
+        for name in sorted(files):
+            for row in _read_rows(os.path.join(directory, name)):
+                yield _run(name), row
+
+def read_posts(root, school_partition):
+    """build_post()-shaped posts of one school partition (e.g. "school=62"), comments in thread order.
+
+    When several exports share a root, the latest run's copy of a thread
+    wins, comments included; other runs' comments of it are ignored.
+    """
+    posts = {}  # post_url -> (run, row)
+    for run, row in _table_rows(root, "posts", school_partition):
+        if row["post_url"] not in posts or run >= posts[row["post_url"]][0]:
+            posts[row["post_url"]] = (run, row)
+    comments = {}  # post_url -> index -> row
+    for run, row in _table_rows(root, "comments", school_partition):
+        if row["post_url"] in posts and posts[row["post_url"]][0] == run:
+            comments.setdefault(row["post_url"], {})[row["index"]] = row
+    result = []
+    for post_url, (_, row) in posts.items():
+        post = {key: row[key] for key in ("title", "post_url", "content", "author", "date", "views",
+                                          "upvotes", "downvotes")}
+        thread = comments.get(post_url, {})
+        post["comments"] = [{key: thread[index][key] for key in ("author", "date", "content")}
+                            for index in sorted(thread)]
+        result.append(post)
+    return result
+
+def load(root, sink):
+    """Replay an export into another sink (e.g. a FirestoreSink), school by school."""
+    schools_dir = os.path.join(root, "schools")
+    for partition in sorted(os.listdir(schools_dir)):
+        schools = [row for _, row in _table_rows(root, "schools", partition)]
+        if not schools:
+            continue
+        sink.write_school(schools[-1])
+        for post in read_posts(root, partition):
+            sink.write_post(schools[-1]["uni_id"], post)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load a JSONL/Parquet export into Firestore.")
+    parser.add_argument("root", help="export directory written by cli.py posts --sink jsonl/parquet")
+    args = parser.parse_args()
+
+    firestore_sink = FirestoreSink()
+    load(args.root, firestore_sink)
+    firestore_sink.writer.close()
+    print(f"Firestore writes: {firestore_sink.summary()}")
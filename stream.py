@@ -0,0 +1,199 @@
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+from dedup import SeenThreads
+from http_cache import parse_cached
+from http_client import fetch
+import parsers
+from parsers import listing_page_url, parse_listing_page
+from records import Comment, Post, to_datetime, to_timestamp
+from scrape import fetch_schools, fetch_thread_page, thread_page_pool
+
+# Record kinds, in the order a post's records arrive
+SCHOOL = "school"
+POST = "post"
+COMMENT = "comment"
+POST_END = "post_end"
+
+# ---------------------- Records ----------------------
+def school_record(school):
+    return {"kind": SCHOOL, **school}
+
+def post_record(uni_id, entry, content):
+    # Everything build_post() stores except the comments, which follow as their own records
+    return {
+        "kind": POST,
+        "uni_id": uni_id,
+        "post_url": entry["post_url"],
+        "title": entry["title"],
+        "content": content or entry["snippet"],
+        "author": entry["author"],
+        "date": entry["date"],
+        "views": entry["views"],
+        "upvotes": entry["upvotes"],
+        "downvotes": entry["downvotes"],
+    }
+
+def comment_record(uni_id, post_url, index, comment):
+    return {"kind": COMMENT, "uni_id": uni_id, "post_url": post_url, "index": index, "author": comment.author,
+            "date": comment.date, "content": comment.content}
+
+def post_end_record(uni_id, entry, pages, last_page_comments, comment_count, last_comment_date):
+    # Closes a post; carries what checkpoints.record_thread() needs
+    return {
+        "kind": POST_END,
+        "uni_id": uni_id,
+        "post_url": entry["post_url"],
+        "entry": entry,
+        "pages": pages,
+        "last_page_comments": last_page_comments,
+        "comment_count": comment_count,
+        "last_comment_date": last_comment_date,
+    }
+
+class ThreadRecords:
+    """Turns one thread's parsed pages, fed in order, into POST, COMMENT... and POST_END records.
+
+    Only counters are kept between pages, so nothing grows with the thread.
+    """
+
+    def __init__(self, uni_id, entry):
+        self.uni_id = uni_id
+        self.entry = entry
+        self.comment_count = 0
+        self.pages = 0
+        self.last_page_comments = 0
+        self.last_comment_date = None
+
+    def start(self, first_page):
+        return post_record(self.uni_id, self.entry, first_page[0] if first_page is not None else None)
+
+    def page(self, page):
+        self.pages += 1
+        self.last_page_comments = len(page[1])
+        for comment in page[1]:
+            yield comment_record(self.uni_id, self.entry["post_url"], self.comment_count, comment)
+            self.comment_count += 1
+            if comment.timestamp and (self.last_comment_date is None or comment.timestamp > self.last_comment_date):
+                self.last_comment_date = comment.timestamp
+
+    def end(self):
+        return post_end_record(self.uni_id, self.entry, self.pages, self.last_page_comments,
+                               self.comment_count, to_datetime(self.last_comment_date))
+
+def thread_records(uni_id, entry, pages):
+    """Records for a thread from an iterable of parsed pages, consumed one page at a time."""
+    builder = ThreadRecords(uni_id, entry)
+    pages = iter(pages)
+    page = next(pages, None)
+    yield builder.start(page)
+    while page is not None:
+        yield from builder.page(page)
+        page = next(pages, None)
+    yield builder.end()
+
+def collect_posts(records):
+    """Turn a record stream back into (records.Post, uni_id) pairs, as build_post() makes them.
+
+    For sinks that still store comments inside the post document. Records
+    of different posts may interleave (see Crawler.stream); only posts
+    still in progress are held.
+    """
+    open_posts = {}
+    for record in records:
+        if record["kind"] == POST:
+            open_posts[record["uni_id"], record["post_url"]] = Post(
+                record["title"], record["post_url"], record["content"], record["author"],
+                to_timestamp(record["date"]), [], record["views"], record["upvotes"], record["downvotes"])
+        elif record["kind"] == COMMENT:
+            open_posts[record["uni_id"], record["post_url"]].comments.append(
+                Comment(record["author"], to_timestamp(record["date"]), record["content"]))
+        elif record["kind"] == POST_END:
+            yield open_posts.pop((record["uni_id"], record["post_url"])), record["uni_id"]
+
+# ---------------------- Blocking Iterators ----------------------
+def iter_schools(url=None):
+    yield from fetch_schools(url or f"{parsers.BASE_URL}/list/")
+
+def iter_listing(uni_id, cutoff=None):
+    """Listing entries newer than `cutoff` (default two weeks), fetching listing pages lazily."""
+    cutoff = cutoff or datetime.now(timezone.utc) - timedelta(weeks=2)
+    page = 1
+    while True:
+        response = fetch(listing_page_url(uni_id, page))
+        if response.status_code != 200:
+            print(f"Failed to retrieve page {page} for uni_id {uni_id}. Status code: {response.status_code}")
+            return
+        parsed = parse_cached(response, "listing", parse_listing_page)
+        if parsed is None:
+            return
+        entries, has_next = parsed
+        for entry in entries:
+            if not (entry["post_url"] and entry["date"] and entry["date"] >= cutoff):
+                return
+            yield entry
+        if not has_next:
+            return
+        page += 1
+
+def _fetch_ahead(post_url, numbers, prefetch):
+    # Yield pages in order while keeping at most `prefetch` requests in flight
+    numbers = iter(numbers)
+    pending = deque(thread_page_pool.submit(fetch_thread_page, post_url, n) for n in islice(numbers, prefetch))
+    try:
+        while pending:
+            page = pending.popleft().result()
+            n = next(numbers, None)
+            if n is not None:
+                pending.append(thread_page_pool.submit(fetch_thread_page, post_url, n))
+            yield page
+    finally:
+        for future in pending:
+            future.cancel()
+
+def iter_thread_pages(post_url, prefetch=2):
+    """Parsed thread pages in order, up to the first missing one.
+
+    Like scrape.scrape_thread, pages 2..N are fetched in parallel when page
+    1 tells N, but only `prefetch` at a time, and NEXT links are followed
+    after that in case the thread grew.
+    """
+    page = fetch_thread_page(post_url, 1)
+    if page is None:
+        return
+    yield page
+    number = 1
+    if page[2] and page[3]:
+        for page in _fetch_ahead(post_url, range(2, page[3] + 1), max(prefetch, 1)):
+            if page is None:
+                return
+            number += 1
+            yield page
+    while page[2]:
+        number += 1
+        page = fetch_thread_page(post_url, number)
+        if page is None:
+            return
+        yield page
+
+def iter_comments(post_url, prefetch=2):
+    for page in iter_thread_pages(post_url, prefetch):
+        yield from page[1]
+
+def iter_posts(uni_id, cutoff=None, prefetch=2, seen=None):
+    """POST, COMMENT and POST_END records for one school's recent threads, each thread once."""
+    seen = seen if seen is not None else SeenThreads()
+    for entry in iter_listing(uni_id, cutoff):
+        if not seen.claim(entry["post_url"]):
+            continue
+        yield from thread_records(uni_id, entry, iter_thread_pages(entry["post_url"], prefetch))
+
+def iter_records(schools=None, cutoff=None, prefetch=2):
+    """A SCHOOL record followed by its post records, for each school (default: every school on /list/)."""
+    seen = SeenThreads()
+    for school in iter_schools() if schools is None else schools:
+        if not school.get("uni_id"):
+            continue
+        yield school_record(school)
+        yield from iter_posts(school["uni_id"], cutoff, prefetch, seen)
@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+DEFAULT_PATH = "crawl_queue.db"
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+Task = namedtuple("Task", "id kind key payload attempts")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    lease_owner TEXT,
+    lease_expires REAL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (state, priority DESC, id);
+CREATE TABLE IF NOT EXISTS results (
+    task_key TEXT PRIMARY KEY,
+    grp TEXT NOT NULL,
+    data BLOB
+);
+CREATE INDEX IF NOT EXISTS results_grp ON results (grp);
+"""
+
+# ---------------------- Durable Work Queue ----------------------
+class WorkQueue:
+    """SQLite-backed task queue that survives crashes and restarts.
+
+    Tasks are unique by key, so re-enqueueing finished work is a no-op.
+    claim() leases pending tasks to a worker; a lease that isn't completed
+    or failed before it expires (the worker died) puts the task back to
+    pending. Failed tasks are retried until `max_attempts`, then parked as
+    failed. The database runs in WAL mode so several worker processes can
+    drain the same file. A small `results` table lets tasks leave
+    intermediate output for a later task to pick up.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_attempts=3, lease_seconds=300):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _conn(self):
+        return _Transaction(self._connection())
+
+    def enqueue(self, kind, key, payload, priority=0):
+        """Add a task unless one with this key already exists; returns True when added."""
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO tasks (kind, key, payload, priority, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(payload), priority, time.time()))
+            return cursor.rowcount > 0
+
+    def claim(self, worker_id, limit=1):
+        now = time.time()
+        with self._conn() as conn:
+            # Leases from dead workers go back to the pool first
+            conn.execute(
+                "UPDATE tasks SET state = ?, lease_owner = NULL, updated_at = ? "
+                "WHERE state = ? AND lease_expires < ?", (PENDING, now, IN_FLIGHT, now))
+            rows = conn.execute(
+                "SELECT id, kind, key, payload, attempts FROM tasks WHERE state = ? "
+                "ORDER BY priority DESC, id LIMIT ?", (PENDING, limit)).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET state = ?, lease_owner = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                [(IN_FLIGHT, worker_id, now + self.lease_seconds, now, row[0]) for row in rows])
+        return [Task(row[0], row[1], row[2], json.loads(row[3]), row[4]) for row in rows]
+
+    def heartbeat(self, task, worker_id):
+        # Extend the lease on a long-running task
+        with self._conn() as conn:
+            conn.execute("UPDATE tasks SET lease_expires = ? WHERE id = ? AND lease_owner = ?",
+                         (time.time() + self.lease_seconds, task.id, worker_id))
+
+    def complete(self, task):
+        with self._conn() as conn:
+            conn.execute("UPDATE tasks SET state = ?, lease_owner = NULL, last_error = NULL, updated_at = ? "
+                         "WHERE id = ?", (DONE, time.time(), task.id))
+
+    def fail(self, task, error):
+        """Record a failed attempt; the task is retried until max_attempts."""
+        attempts = task.attempts + 1
+        state = FAILED if attempts >= self.max_attempts else PENDING
+        with self._conn() as conn:
+            conn.execute("UPDATE tasks SET state = ?, attempts = ?, last_error = ?, lease_owner = NULL, "
+                         "updated_at = ? WHERE id = ?", (state, attempts, str(error), time.time(), task.id))
+        return state
+
+    def retry_failed(self):
+        """Give every parked task another max_attempts tries."""
+        with self._conn() as conn:
+            return conn.execute("UPDATE tasks SET state = ?, attempts = 0, updated_at = ? WHERE state = ?",
+                                (PENDING, time.time(), FAILED)).rowcount
+
+    def clear(self):
+        """Drop every task and result, e.g. to start a new run in a queue whose last run finished."""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM tasks")
+            conn.execute("DELETE FROM results")
+
+    def counts(self) -> dict:
+        with self._conn() as conn:
+            rows = conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+        return {**{state: 0 for state in (PENDING, IN_FLIGHT, DONE, FAILED)}, **dict(rows)}
+
+    def failures(self):
+        with self._conn() as conn:
+            return conn.execute("SELECT kind, key, attempts, last_error FROM tasks WHERE state = ?",
+                                (FAILED,)).fetchall()
+
+    def is_drained(self):
+        counts = self.counts()
+        return counts[PENDING] == 0 and counts[IN_FLIGHT] == 0
+
+    def put_result(self, task_key, group, data):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO results (task_key, grp, data) VALUES (?, ?, ?)",
+                         (task_key, group, data))
+
+    def results(self, group):
+        with self._conn() as conn:
+            return conn.execute("SELECT task_key, data FROM results WHERE grp = ?", (group,)).fetchall()
+
+    def drop_results(self, group):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM results WHERE grp = ?", (group,))
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT around a block, so claims from several processes never overlap."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *exc):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")